@@ -3,7 +3,8 @@ from motlinearity.plotting import PlotterTrajs, PlotterFrac, PlotterHist
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import argparse
-from typing import List
+import glob
+from typing import List, Optional
 import json
 import numpy as np
 import os
@@ -16,20 +17,19 @@ def write_fig(fig: go.Figure, bname: str, figures_dir: str):
     print(f"Wrote to {fname}")
 
 
-def linear_analysis(file_to_tracks: ms.FileToTracks, tol: float, show: bool, figures_dir: str, figures_tag: str):
+def linear_analysis(file_to_tracks: ms.FileToTracks, tol: float, show: bool, figures_dir: str, figures_tag: str, bootstrap_resamples: int = 0, checkpoint: Optional[ms.Checkpoint] = None, no_workers: int = 1, bootstrap_by_file: bool = True):
     print("---")
     print(figures_tag)
     print("---")
 
     # Linear segments duration analysis
-    lin_segments_duration_idxs = ms.measure_lin_segments_duration_idxs_all_files(file_to_tracks, tol=tol)
-    mean = np.mean(lin_segments_duration_idxs, dtype=float)
-    std = np.std(lin_segments_duration_idxs, dtype=float)
-    print(f"Mean duration of linear segments = {mean:.2f} +- {std:.2f} frames")
+    durations = ms.measure_lin_segments_duration_aggregate_all_files(file_to_tracks, tol=tol, no_workers=no_workers, checkpoint=checkpoint)
+    print(f"Mean duration of linear segments = {durations.stats.mean:.2f} +- {durations.stats.std:.2f} frames")
+    print(f"Median duration of linear segments = {durations.sketch.quantile(0.5):.1f} frames, 90th percentile = {durations.sketch.quantile(0.9):.1f} frames")
 
     fig = go.Figure()
     ph = PlotterHist(fig)
-    ph.add_hist(lin_segments_duration_idxs)
+    ph.add_hist_counts(durations.hist.bins(), durations.hist.counts)
     fig.update_layout(
         title=f"Linear segments duration ({figures_tag})<br>(slope difference tol={tol})",
         )
@@ -39,10 +39,15 @@ def linear_analysis(file_to_tracks: ms.FileToTracks, tol: float, show: bool, fig
 
     # Tolerance analysis
     print("---")
-    tol_to_frac_ave_std = ms.measure_tol_to_ave_frac_all_files(file_to_tracks).tol_to_frac_ave_std
+    tol_to_frac = ms.measure_tol_to_ave_frac_all_files(file_to_tracks, checkpoint=checkpoint)
+    tol_to_frac_ave_std = tol_to_frac.tol_to_frac_ave_std
     print("Average fraction of points in linear segments by tolerance:")
     for tol,(ave_frac,std_frac) in tol_to_frac_ave_std.items():
         print(f"\ttol={tol:.2f}, ave_frac={ave_frac:.2f} +- {std_frac:.2f}")
+    if bootstrap_resamples > 0:
+        print(f"Bootstrap {bootstrap_resamples} resamples of {'sequences' if bootstrap_by_file else 'tracks'}:")
+        for tol,ci in tol_to_frac.bootstrap(by_file=bootstrap_by_file, no_resamples=bootstrap_resamples).items():
+            print(f"\ttol={tol:.2f}, ave_frac={ci.mean:.2f} ({100*ci.confidence:.0f}% CI {ci.ci_low:.2f} - {ci.ci_high:.2f})")
 
     fig = go.Figure()
     pf = PlotterFrac(fig)
@@ -57,8 +62,11 @@ def linear_analysis(file_to_tracks: ms.FileToTracks, tol: float, show: bool, fig
     # Perturb analysis
     print("---")
     perturb_mag = 0.5
-    perturb = ms.measure_ave_frac_perturb_all_files(file_to_tracks, perturb_mag)
+    perturb = ms.measure_ave_frac_perturb_all_files(file_to_tracks, perturb_mag, checkpoint=checkpoint)
     print(f"Ave fraction of linear points = {perturb.mean:.2f} +- {perturb.std:.2f} found by perturbing with magnitude {perturb_mag}")
+    if bootstrap_resamples > 0:
+        ci = perturb.bootstrap(by_file=bootstrap_by_file, no_resamples=bootstrap_resamples)
+        print(f"Bootstrap {bootstrap_resamples} resamples of {'sequences' if bootstrap_by_file else 'tracks'}: {100*ci.confidence:.0f}% CI {ci.ci_low:.2f} - {ci.ci_high:.2f}")
 
 
 def plot_tracks_tog(track_ids: List[int], tracks: ms.Tracks, tol: float, src_str: str, show: bool, figures_dir: str):
@@ -121,22 +129,51 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--mot", type=str, help="MOT", required=True, choices=[ms.DataSpec.Mot.MOT17.value, ms.DataSpec.Mot.MOT20.value])
-    parser.add_argument("--command", type=str, help="Command to run. (1) plot-traj - Plot some trajectories from the dataset and their linear segments. (2) plot-traj-tog - Plot some trajectories from the dataset and their linear segments side-by-side. (3) lin-analysis - Run the linear analysis for the dataset. (4) random-walk-sim - simulate a random walk. (5) random-walk-analysis - Analyze the random walk. (6) plot-traj-tog-random-walk - Plot the trajectories and linear segments from the random walks.", required=True, choices=["plot-traj", "plot-traj-tog", "lin-analysis", "random-walk-sim", "random-walk-analysis", "plot-traj-tog-random-walk"])
+    parser.add_argument("--command", type=str, help="Command to run. (1) plot-traj - Plot some trajectories from the dataset and their linear segments. (2) plot-traj-tog - Plot some trajectories from the dataset and their linear segments side-by-side. (3) lin-analysis - Run the linear analysis for the dataset. (4) random-walk-sim - simulate a random walk. (5) random-walk-analysis - Analyze the random walk. (6) plot-traj-tog-random-walk - Plot the trajectories and linear segments from the random walks. (7) benchmark-load - Measure the loading throughput for different numbers of workers. (8) det-conf-analysis - Run the linear analysis on tracker output (--tracker-glob) for a grid of confidence thresholds and tolerances. (9) lin-table - Write per-track linear stats and per-segment tables for a grid of tolerances. (10) frame-replay - Replay each sequence frame by frame through the frame-synchronous detector and report its throughput. (11) detector-eval - Score detector configurations against the ground truth segments of simulated piecewise-linear tracks, with their throughput.", required=True, choices=["plot-traj", "plot-traj-tog", "lin-analysis", "random-walk-sim", "random-walk-analysis", "plot-traj-tog-random-walk", "benchmark-load", "det-conf-analysis", "lin-table", "frame-replay", "detector-eval"])
     parser.add_argument("--file", type=str, help="File to plot", required=False, default="MOT17-09-FRCNN")
     parser.add_argument("--track-ids", type=int, help="Track indexes to plot", required=False, nargs="+", default=[9,10,5])
     parser.add_argument("--tol", type=float, help="Tolerance", required=False, default=0.1)
     parser.add_argument("--show", action="store_true", help="Show plots")
+    parser.add_argument("--auto-tol", action="store_true", help="Estimate the tolerance from the localization noise of the data instead of using --tol (the perturbation magnitude is not estimated)")
+    parser.add_argument("--auto-tol-coverage", type=float, help="Fraction of truly linear triplets that should be detected as linear with the estimated tolerance", required=False, default=0.9)
     parser.add_argument("--random-walk-json", type=str, help="File name to write random walk to", required=False, default="random_walk.json")
+    parser.add_argument("--random-walk-model", type=str, help="Motion model of the simulated trajectories", required=False, default=ms.RandomWalkOptions.MotionModel.EMPIRICAL.value, choices=[ m.value for m in ms.RandomWalkOptions.MotionModel ])
+    parser.add_argument("--random-walk-no-trajs", type=int, help="Number of simulated trajectories", required=False, default=100)
+    parser.add_argument("--random-walk-no-pts", type=int, help="Number of points per simulated trajectory", required=False, default=100)
+    parser.add_argument("--random-walk-noise-std", type=float, help="Std of the localization noise added to simulated points (pixels)", required=False, default=0.0)
+    parser.add_argument("--random-piece-frac", type=float, help="Fraction of the pieces of the simulated tracks of detector-eval whose velocity jitters every step, so they are not linear and precision measures detections on nonlinear motion", required=False, default=0.3)
+    parser.add_argument("--min-f1", type=float, help="Segment F1 the detector picked by detector-eval must reach", required=False, default=0.8)
+    parser.add_argument("--no-workers", type=int, help="Number of worker processes, also used to parse the loaded files", required=False, default=1)
+    parser.add_argument("--seed", type=int, help="Random seed for simulations", required=False, default=None)
+    parser.add_argument("--bootstrap-resamples", type=int, help="Number of bootstrap resamples of sequences for confidence intervals (0 to disable)", required=False, default=0)
+    parser.add_argument("--frame-gaps", type=str, help="How to handle missing frames in tracks: none - ignore, split - cut tracks at gaps larger than --max-frame-gap, resample - interpolate onto consecutive frames (gaps larger than --max-frame-gap are cut; interpolated points are never linear centers and are not counted in the stats)", required=False, default="none", choices=["none", "split", "resample"])
+    parser.add_argument("--max-frame-gap", type=int, help="Largest difference of frame ids bridged when handling missing frames (1: none). Defaults to 1 for split and 10 for resample", required=False, default=None)
+    parser.add_argument("--tracker-glob", type=str, help="Glob of tracker output files in the MOT format (<seq>.txt with track ids and confidences) for det-conf-analysis", required=False, default=None)
+    parser.add_argument("--results-dir", type=str, help="Directory to write result tables to", required=False, default="results")
+    parser.add_argument("--results-format", type=str, help="File format of result tables", required=False, default="csv", choices=["csv", "parquet", "arrow"])
+    parser.add_argument("--checkpoint-dir", type=str, help="Directory to save results of each sequence to as they complete; a rerun resumes from them", required=False, default=None)
+    parser.add_argument("--no-resume", action="store_true", help="Recompute all results even if they are in --checkpoint-dir")
+    parser.add_argument("--checkpoint-chunk-size", type=int, help="Number of random walk trajectories per checkpointed chunk", required=False, default=100)
     parser.add_argument("--figures-dir", type=str, help="Directory to write figures to", required=False, default="figures")
     args = parser.parse_args()
 
-    # Load the data
-    mot_file_to_tracks = ms.load_tracks(ms.DataSpec(
+    # Load the data, reading files concurrently and parsing them in --no-workers processes
+    load_result = ms.load_tracks_parallel([ms.DataSpec(
         mot=ms.DataSpec.Mot(args.mot),
         split=ms.DataSpec.Split.TRAIN,
         mode=ms.DataSpec.Mode.GT,
         mot17_method=ms.DataSpec.Mot17Method.FRCNN
-        ))
+        )], no_parse_workers=args.no_workers if args.no_workers > 1 else 0)[0]
+    if len(load_result.errors) > 0:
+        print(f"Failed to load {len(load_result.errors)} files, continuing without them: {', '.join([ error.fname for error in load_result.errors ])}")
+    assert len(load_result.file_to_tracks) > 0, f"No tracks loaded from {load_result.spec.fnames_glob}"
+    mot_file_to_tracks = load_result.file_to_tracks
+    if args.max_frame_gap is None:
+        args.max_frame_gap = 10 if args.frame_gaps == "resample" else 1
+    if args.frame_gaps == "split":
+        mot_file_to_tracks = { fname: ms.split_tracks_at_frame_gaps(tracks, args.max_frame_gap) for fname,tracks in mot_file_to_tracks.items() }
+    elif args.frame_gaps == "resample":
+        mot_file_to_tracks = { fname: ms.resample_tracks_to_frame_grid(tracks, args.max_frame_gap) for fname,tracks in mot_file_to_tracks.items() }
 
     if args.command == "plot-traj-tog":
 
@@ -183,8 +220,17 @@ if __name__ == "__main__":
         print(f"Mean displacement in x = {disps.xy_disp_mean[0]:.2f} +- {disps.xy_disp_std[0]:.2f} pixels")
         print(f"Mean displacement in y = {disps.xy_disp_mean[1]:.2f} +- {disps.xy_disp_std[1]:.2f} pixels")
 
-        # Simulate random walk
-        tracks = ms.sample_random_walk(no_trajs=100, no_pts_per_traj=100, disps_probs=disps.disps_probs)
+        # Simulate random walk, with the speed of the other motion models matched to the measured displacements
+        speeds = np.hypot(*np.array(disps.xy_disps, dtype=float).T)
+        options = ms.RandomWalkOptions(
+            motion_model=ms.RandomWalkOptions.MotionModel(args.random_walk_model),
+            speed_mean=float(np.mean(speeds)),
+            speed_std=float(np.std(speeds)),
+            noise_std=args.random_walk_noise_std
+            )
+        walks = ms.sample_walks_packed(no_trajs=args.random_walk_no_trajs, no_pts_per_traj=args.random_walk_no_pts, options=options, disps_probs=disps.disps_probs, seed=args.seed)
+        tracks = walks.to_tracks()
+        print(f"Simulated {walks.packed.no_tracks} trajs with {len(walks.seg_starts)} ground truth linear segments")
         
         with open(args.random_walk_json, "w") as f:
             json.dump(tracks.to_dict(), f, indent=None)
@@ -198,12 +244,104 @@ if __name__ == "__main__":
             tracks = ms.TracksXy.from_dict(json.load(f))
             print(f"Loaded {len(tracks.tracks)} trajs from {args.random_walk_json}")
 
-        linear_analysis({ "random_walk": tracks }, tol=args.tol, show=args.show, figures_dir=args.figures_dir, figures_tag="Random Walk")
+        # Simulated trajectories are independent and come from a single source, so tracks (not checkpoint chunks) are resampled
+        file_to_tracks = { "random_walk": tracks }
+        checkpoint = None
+        if args.checkpoint_dir is not None:
+            fingerprint = { "data": ms.fingerprint_file_to_tracks(file_to_tracks), "random_walk_json": os.path.abspath(args.random_walk_json), "checkpoint_chunk_size": args.checkpoint_chunk_size }
+            checkpoint = ms.Checkpoint(os.path.join(args.checkpoint_dir, "random_walk"), resume=not args.no_resume, fingerprint=fingerprint)
+            file_to_tracks = ms.chunk_file_to_tracks(file_to_tracks, args.checkpoint_chunk_size)
+        linear_analysis(file_to_tracks, tol=args.tol, show=args.show, figures_dir=args.figures_dir, figures_tag="Random Walk", bootstrap_resamples=args.bootstrap_resamples, checkpoint=checkpoint, no_workers=args.no_workers, bootstrap_by_file=False)
 
     elif args.command == "lin-analysis":
 
+        tol = args.tol
+        if args.auto_tol:
+            disps = ms.measure_bbox_coord_displacements(mot_file_to_tracks)
+            file_to_estimate = ms.estimate_tol_all_files(mot_file_to_tracks, coverage=args.auto_tol_coverage, disps=disps)
+            for fname,estimate in file_to_estimate.items():
+                print(f"{fname}: noise = {estimate.noise_std:.2f} pixels, tol = {estimate.tol:.3f}")
+            tols = [ estimate.tol for estimate in file_to_estimate.values() if np.isfinite(estimate.tol) ]
+            if len(tols) > 0:
+                tol = float(np.median(tols))
+            else:
+                print(f"No tolerance could be estimated, using --tol {tol}")
+            print(f"Using tol = {tol:.3f}")
+
+        checkpoint = None
+        if args.checkpoint_dir is not None:
+            fingerprint = { "data": ms.fingerprint_file_to_tracks(mot_file_to_tracks), "mot": args.mot, "frame_gaps": args.frame_gaps, "max_frame_gap": args.max_frame_gap }
+            checkpoint = ms.Checkpoint(os.path.join(args.checkpoint_dir, args.mot), resume=not args.no_resume, fingerprint=fingerprint)
+
         # Linear segments duration analysis
-        linear_analysis(mot_file_to_tracks, tol=args.tol, show=args.show, figures_dir=args.figures_dir, figures_tag=args.mot)
+        linear_analysis(mot_file_to_tracks, tol=tol, show=args.show, figures_dir=args.figures_dir, figures_tag=args.mot, bootstrap_resamples=args.bootstrap_resamples, checkpoint=checkpoint, no_workers=args.no_workers)
+
+    elif args.command == "benchmark-load":
+
+        # The detection methods only select files of MOT17; MOT20 has one set of files
+        methods = list(ms.DataSpec.Mot17Method) if args.mot == ms.DataSpec.Mot.MOT17.value else [ms.DataSpec.Mot17Method.FRCNN]
+        specs = [ ms.DataSpec(mot=ms.DataSpec.Mot(args.mot), mode=mode, mot17_method=method) for mode in ms.DataSpec.Mode for method in methods ]
+        for parse_in_processes in [False, True]:
+            no_workers_to_mb_per_sec = ms.benchmark_load_tracks(specs, [1,2,4,8], parse_in_processes=parse_in_processes)
+            print(f"Throughput ({'parsing in processes' if parse_in_processes else 'parsing in threads'}):")
+            for no_workers,mb_per_sec in no_workers_to_mb_per_sec.items():
+                print(f"\t{no_workers} workers: {mb_per_sec:.1f} MB/s")
+
+    elif args.command == "det-conf-analysis":
+
+        # MOT det.txt files have no track ids, so tracker output in the MOT format is needed, one <seq>.txt per sequence
+        assert args.tracker_glob is not None, "det-conf-analysis needs tracker output with track ids and confidences - use --tracker-glob"
+        fnames = sorted(glob.glob(args.tracker_glob))
+        assert len(fnames) > 0, f"No files found in {args.tracker_glob}"
+        det_file_to_tracks = { os.path.splitext(os.path.basename(fname))[0]: ms.read_file(fname, is_gt=False) for fname in fnames }
+        confs = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+        tols = [0, 0.025, 0.05, 0.1, 0.2, 0.5, 1.0]
+        ctf = ms.measure_conf_tol_to_frac_all_files(det_file_to_tracks, confs, tols)
+        print("Average fraction of points in linear segments by confidence threshold (rows) and tolerance (columns):")
+        print("\tconf\t" + "\t".join([ f"tol={tol:.3f}" for tol in tols ]))
+        for conf,frac_aves in zip(confs, ctf.frac_ave):
+            print(f"\t{conf:.2f}\t" + "\t".join([ f"{frac_ave:.2f}" for frac_ave in frac_aves ]))
+
+    elif args.command == "lin-table":
+
+        options_list = [ ms.LinTripletChecker.Options(mode=ms.LinTripletChecker.Options.Mode.TOL, tol=tol) for tol in [0, 0.025, 0.05, 0.1, 0.2, 0.5, 1.0] ]
+        options_list.append(ms.LinTripletChecker.Options(mode=ms.LinTripletChecker.Options.Mode.PERTURB, perturb_mag=0.5))
+        stats_table, segs_table = ms.build_lin_results_tables_all_files(mot_file_to_tracks, options_list)
+
+        os.makedirs(args.results_dir, exist_ok=True)
+        for table,bname in [(stats_table, "lin_stats"), (segs_table, "lin_segs")]:
+            fname = os.path.join(args.results_dir, f"{bname}_{args.mot}.{args.results_format}")
+            table.write(fname)
+            print(f"Wrote {table.no_rows} rows to {fname}")
+
+    elif args.command == "frame-replay":
+
+        checker = ms.LinTripletChecker(ms.LinTripletChecker.Options(mode=ms.LinTripletChecker.Options.Mode.TOL, tol=args.tol))
+        for fname,tracks in mot_file_to_tracks.items():
+            packed = ms.PackedTracks.from_tracks(tracks)
+            replay = ms.replay_packed_by_frame(packed, checker)
+            no_observed = int(np.sum(packed.observed()))
+            frac = np.sum(replay.is_center_linear) / no_observed if no_observed > 0 else 0
+            print(f"{fname}: {replay.no_frames} frames, {replay.no_boxes} boxes in {replay.duration_sec:.2f} s = {replay.frames_per_sec:.0f} frames/s, {100*frac:.1f}% linear centers")
+
+    elif args.command == "detector-eval":
+
+        options = ms.RandomWalkOptions(motion_model=ms.RandomWalkOptions.MotionModel.PIECEWISE_LINEAR, noise_std=args.random_walk_noise_std, random_piece_frac=args.random_piece_frac)
+        walks = ms.sample_walks_packed(no_trajs=args.random_walk_no_trajs, no_pts_per_traj=args.random_walk_no_pts, options=options, seed=args.seed)
+
+        Mode = ms.LinTripletChecker.Options.Mode
+        options_list = [ ms.LinTripletChecker.Options(mode=mode, tol=tol) for mode in [Mode.TOL, Mode.TOL_CROSS, Mode.ANGLE] for tol in [0.01, 0.025, 0.05, 0.1, 0.2, 0.5] ]
+        options_list += [ ms.LinTripletChecker.Options(mode=Mode.PERTURB, perturb_mag=perturb_mag) for perturb_mag in [0.1, 0.25, 0.5, 1.0, 2.0] ]
+        evals = ms.evaluate_detector_grid(walks.packed, walks.seg_starts, walks.seg_ends, options_list, no_workers=args.no_workers)
+        for e in evals:
+            param = f"perturb_mag={e.options.perturb_mag}" if e.options.mode == Mode.PERTURB else f"tol={e.options.tol}"
+            print(f"{e.options.mode.value:>10} {param:<18} segment P/R/F1 = {e.scores.seg_precision:.3f}/{e.scores.seg_recall:.3f}/{e.scores.seg_f1:.3f}, point P/R/F1 = {e.scores.point_precision:.3f}/{e.scores.point_recall:.3f}/{e.scores.point_f1:.3f}, {e.points_per_sec:.2e} points/s")
+
+        best = ms.fastest_detector(evals, min_f1=args.min_f1)
+        if best is None:
+            print(f"No configuration reaches segment F1 {args.min_f1}")
+        else:
+            print(f"Fastest configuration with segment F1 >= {args.min_f1}: {best.options.to_dict()}")
 
     else:
         raise NotImplementedError(f"Command {args.command} not implemented")
\ No newline at end of file
@@ -2,4 +2,18 @@ from .analyze import *
 from .data import *
 from .lin_detection import *
 from .lin_detection_triplets import *
-from .random_walk import *
\ No newline at end of file
+from .random_walk import *
+from .data_arrays import *
+from .kinematics import *
+from .bootstrap import *
+from .shared_data import *
+from .frame_gaps import *
+from .analyze_conf import *
+from .lin_detection_windows import *
+from .lin_detection_packed import *
+from .results_table import *
+from .tol_estimation import *
+from .lin_detection_frames import *
+from .checkpoint import *
+from .evaluation import *
+from .aggregators import *
@@ -0,0 +1,294 @@
+from motlinearity.data import FileToTracks
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_triplets import LinTripletChecker
+from motlinearity.lin_detection_packed import find_linear_centers_packed, center_mask_to_segment_bounds
+from motlinearity.shared_data import SharedTracks, imap_shared_tracks
+from motlinearity.checkpoint import Checkpoint
+
+
+from typing import Any, Dict, Optional
+from functools import partial
+from tqdm import tqdm
+import numpy as np
+
+
+class IntHistogram:
+    # Counts of non-negative integer values in bins of size 1, grown as larger values arrive
+    # With max_value set, larger values are counted in the last bin and in no_overflow, bounding memory
+
+
+    def __init__(self, max_value: Optional[int] = None):
+        self.max_value = max_value
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.no_overflow = 0
+
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+
+    def _fit(self, size: int):
+        if size > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(size - len(self.counts), dtype=np.int64)])
+
+
+    def add(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.int64).ravel()
+        if len(values) == 0:
+            return
+        assert values.min() >= 0, f"Histogram values must be non-negative, got {values.min()}"
+        if self.max_value is not None:
+            self.no_overflow += int(np.sum(values > self.max_value))
+            values = np.minimum(values, self.max_value)
+        binned = np.bincount(values)
+        self._fit(len(binned))
+        self.counts[:len(binned)] += binned
+
+
+    def merge(self, other: "IntHistogram"):
+        self._fit(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+        self.no_overflow += other.no_overflow
+
+
+    def bins(self) -> np.ndarray:
+        return np.arange(len(self.counts))
+
+
+    def to_dict(self) -> Dict[str,Any]:
+        return { "max_value": self.max_value, "counts": self.counts.tolist(), "no_overflow": self.no_overflow }
+
+
+    @classmethod
+    def from_dict(cls, d: Dict[str,Any]):
+        hist = cls(d["max_value"])
+        hist.counts = np.array(d["counts"], dtype=np.int64)
+        hist.no_overflow = d["no_overflow"]
+        return hist
+
+
+class RunningStats:
+    # Count, mean and variance updated in batches and merged with the parallel form of Welford's algorithm (Chan et al.)
+
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    @property
+    def var(self) -> float:
+        # Population variance, as np.var
+        return self.m2 / self.count if self.count > 0 else 0.0
+
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.var))
+
+
+    def _combine(self, count: int, mean: float, m2: float, min_: float, max_: float):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, min_)
+        self.max = max(self.max, max_)
+
+
+    def add(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return
+        mean = float(np.mean(values))
+        self._combine(len(values), mean, float(np.sum((values - mean)**2)), float(values.min()), float(values.max()))
+
+
+    def merge(self, other: "RunningStats"):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+
+    def to_dict(self) -> Dict[str,Any]:
+        # Infinite min and max of empty stats are stored as None, since JSON has no infinity
+        return { "count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min if self.count > 0 else None, "max": self.max if self.count > 0 else None }
+
+
+    @classmethod
+    def from_dict(cls, d: Dict[str,Any]):
+        stats = cls()
+        stats.count = d["count"]
+        stats.mean = d["mean"]
+        stats.m2 = d["m2"]
+        stats.min = d["min"] if d["min"] is not None else np.inf
+        stats.max = d["max"] if d["max"] is not None else -np.inf
+        return stats
+
+
+class QuantileSketch:
+    # Quantiles with relative error at most relative_accuracy, from counts in logarithmic buckets (DDSketch)
+    # Bucket i holds values in (gamma^(i-1), gamma^i]; merging adds bucket counts, so the sketch is exactly mergeable
+    # and its size grows only with the log of the range of the values
+
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        assert 0 < relative_accuracy < 1, f"Relative accuracy must be in (0,1), got {relative_accuracy}"
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive: Dict[int,int] = {}
+        self.negative: Dict[int,int] = {}
+        self.zero_count = 0
+
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.positive.values()) + sum(self.negative.values())
+
+
+    def _add_to(self, buckets: Dict[int,int], magnitudes: np.ndarray):
+        idxs, counts = np.unique(np.ceil(np.log(magnitudes) / np.log(self.gamma)).astype(np.int64), return_counts=True)
+        for i,c in zip(idxs.tolist(), counts.tolist()):
+            buckets[i] = buckets.get(i, 0) + c
+
+
+    def add(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float).ravel()
+        self.zero_count += int(np.sum(values == 0))
+        self._add_to(self.positive, values[values > 0])
+        self._add_to(self.negative, -values[values < 0])
+
+
+    def merge(self, other: "QuantileSketch"):
+        assert self.gamma == other.gamma, "Can only merge sketches with the same relative accuracy"
+        for buckets,other_buckets in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for i,c in other_buckets.items():
+                buckets[i] = buckets.get(i, 0) + c
+        self.zero_count += other.zero_count
+
+
+    def _bucket_value(self, i: int) -> float:
+        return 2 * self.gamma**i / (self.gamma + 1)
+
+
+    def quantile(self, q: float) -> float:
+        # Value of rank floor(q (count - 1)), as np.quantile with lower interpolation up to the relative accuracy
+        count = self.count
+        if count == 0:
+            return np.nan
+        rank = int(np.floor(q * (count - 1)))
+        seen = 0
+        for i in sorted(self.negative, reverse=True):
+            seen += self.negative[i]
+            if seen > rank:
+                return -self._bucket_value(i)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for i in sorted(self.positive):
+            seen += self.positive[i]
+            if seen > rank:
+                return self._bucket_value(i)
+        return self._bucket_value(max(self.positive))
+
+
+    def to_dict(self) -> Dict[str,Any]:
+        # Bucket idxs are stored as (idx, count) pairs, since JSON keys are strings
+        return { "relative_accuracy": self.relative_accuracy, "positive": list(self.positive.items()), "negative": list(self.negative.items()), "zero_count": self.zero_count }
+
+
+    @classmethod
+    def from_dict(cls, d: Dict[str,Any]):
+        sketch = cls(d["relative_accuracy"])
+        sketch.positive = { int(i): int(c) for i,c in d["positive"] }
+        sketch.negative = { int(i): int(c) for i,c in d["negative"] }
+        sketch.zero_count = d["zero_count"]
+        return sketch
+
+
+class DurationAggregate:
+    # Histogram, running stats and quantile sketch of linear segment durations, updated together
+
+
+    def __init__(self, max_value: Optional[int] = None, relative_accuracy: float = 0.01):
+        self.hist = IntHistogram(max_value)
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+
+
+    def add(self, durations: np.ndarray):
+        self.hist.add(durations)
+        self.stats.add(durations)
+        self.sketch.add(durations)
+
+
+    def merge(self, other: "DurationAggregate"):
+        self.hist.merge(other.hist)
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+
+
+    def to_dict(self) -> Dict[str,Any]:
+        return { "hist": self.hist.to_dict(), "stats": self.stats.to_dict(), "sketch": self.sketch.to_dict() }
+
+
+    @classmethod
+    def from_dict(cls, d: Dict[str,Any]):
+        agg = cls()
+        agg.hist = IntHistogram.from_dict(d["hist"])
+        agg.stats = RunningStats.from_dict(d["stats"])
+        agg.sketch = QuantileSketch.from_dict(d["sketch"])
+        return agg
+
+
+def measure_lin_segments_duration_aggregate_packed(packed: PackedTracks, tol: float, max_value: Optional[int] = None, relative_accuracy: float = 0.01) -> DurationAggregate:
+    # Durations in frames (as LinStats.lin_segments_duration_frames), so segments spanning missing frames count them
+    checker = LinTripletChecker(LinTripletChecker.Options(mode=LinTripletChecker.Options.Mode.TOL, tol=tol))
+    seg_starts, seg_ends = center_mask_to_segment_bounds(find_linear_centers_packed(packed, checker), packed.is_interpolated)
+    agg = DurationAggregate(max_value, relative_accuracy)
+    agg.add(packed.frame_ids[seg_ends] - packed.frame_ids[seg_starts] + 1)
+    return agg
+
+
+def _aggregate_shared(tol: float, max_value: Optional[int], relative_accuracy: float, fname: str, packed: PackedTracks) -> Dict[str,Any]:
+    return measure_lin_segments_duration_aggregate_packed(packed, tol, max_value, relative_accuracy).to_dict()
+
+
+def measure_lin_segments_duration_aggregate_all_files(
+    file_to_tracks: FileToTracks,
+    tol: float,
+    max_value: Optional[int] = None,
+    relative_accuracy: float = 0.01,
+    no_workers: int = 1,
+    checkpoint: Optional[Checkpoint] = None
+    ) -> DurationAggregate:
+    # Per-file aggregates are saved to the checkpoint and merged as each file completes, so memory does not grow
+    # with the number of segments and an interrupted run keeps the files already done
+    # With no_workers > 1, files are processed in worker processes attached to shared memory
+    agg = DurationAggregate(max_value, relative_accuracy)
+    unit = lambda fname: f"lin_segments_duration_frames_aggregate/{tol}/{max_value}/{relative_accuracy}/{fname}"
+    todo = { fname: tracks for fname,tracks in file_to_tracks.items() if checkpoint is None or not checkpoint.has(unit(fname)) }
+
+    if checkpoint is not None:
+        for fname in file_to_tracks:
+            if fname not in todo:
+                agg.merge(DurationAggregate.from_dict(checkpoint.load(unit(fname))))
+
+    def _complete(fname: str, d: Dict[str,Any]):
+        if checkpoint is not None:
+            checkpoint.save(unit(fname), d)
+        agg.merge(DurationAggregate.from_dict(d))
+
+    if no_workers > 1 and len(todo) > 0:
+        with SharedTracks(todo) as shared:
+            for fname,d in imap_shared_tracks(partial(_aggregate_shared, tol, max_value, relative_accuracy), shared.handle, no_workers):
+                _complete(fname, d)
+    else:
+        for fname,tracks in tqdm(todo.items(), desc="Measuring linear stats for each file"):
+            _complete(fname, measure_lin_segments_duration_aggregate_packed(PackedTracks.from_tracks(tracks), tol, max_value, relative_accuracy).to_dict())
+    return agg
@@ -1,11 +1,13 @@
 from motlinearity.data import Track, Tracks, FileToTracks
 from motlinearity.lin_detection import find_linear_segments, LinTripletChecker
+from motlinearity.bootstrap import BootstrapCI, bootstrap_ci
+from motlinearity.checkpoint import Checkpoint
 
 
-from typing import List, Dict, Tuple, Union
+from typing import List, Dict, Tuple, Union, Optional
 import numpy as np
 from tqdm import tqdm
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -14,21 +16,36 @@ class AveFracPerturb:
     std: float
     frac_list: List[float]
 
+    # File each fraction came from, used to resample whole sequences
+    file_list: List[str] = field(default_factory=list)
+    ci: Optional[BootstrapCI] = None
+
     @classmethod
-    def from_list(cls, frac_list: List[float]):
-        return cls(np.mean(frac_list, dtype=float), np.std(frac_list, dtype=float), frac_list)
+    def from_list(cls, frac_list: List[float], file_list: Optional[List[str]] = None):
+        return cls(np.mean(frac_list, dtype=float), np.std(frac_list, dtype=float), frac_list, file_list or [])
+
+    def bootstrap(self, by_file: bool = False, no_resamples: int = 10000, confidence: float = 0.95, seed: Optional[int] = None, no_workers: int = 1) -> BootstrapCI:
+        assert not by_file or len(self.file_list) == len(self.frac_list), "No files recorded for the fractions"
+        groups = self.file_list if by_file else None
+        self.ci = bootstrap_ci(self.frac_list, groups, no_resamples=no_resamples, confidence=confidence, seed=seed, no_workers=no_workers)
+        return self.ci
 
 
-def measure_ave_frac_perturb_all_files(file_to_tracks: FileToTracks, perturb_mag: float) -> AveFracPerturb:
+def measure_ave_frac_perturb_all_files(file_to_tracks: FileToTracks, perturb_mag: float, checkpoint: Optional[Checkpoint] = None) -> AveFracPerturb:
     frac_list = []
+    file_list = []
     for fname,tracks in tqdm(file_to_tracks.items(), desc="Measuring linear stats for each file"):
-        r = measure_ave_frac_perturb(tracks, perturb_mag)
-        frac_list += r.frac_list
-    return AveFracPerturb.from_list(frac_list)
+        if checkpoint is not None:
+            fracs = checkpoint.compute(f"ave_frac_perturb/{perturb_mag}/{fname}", lambda: measure_ave_frac_perturb(tracks, perturb_mag).frac_list)
+        else:
+            fracs = measure_ave_frac_perturb(tracks, perturb_mag).frac_list
+        frac_list += fracs
+        file_list += [fname] * len(fracs)
+    return AveFracPerturb.from_list(frac_list, file_list)
 
 
 def measure_ave_frac_perturb(tracks: Tracks, perturb_mag: float) -> AveFracPerturb:
-    checker = LinTripletChecker(LinTripletChecker.Options(mode=LinTripletChecker.Options.Mode.TOL, perturb_mag=perturb_mag))
+    checker = LinTripletChecker(LinTripletChecker.Options(mode=LinTripletChecker.Options.Mode.PERTURB, perturb_mag=perturb_mag))
 
     frac_list = []
     for track_id,track in tracks.tracks.items():
@@ -44,25 +61,44 @@ class TolToFrac:
     tol_to_frac_ave_std: Dict[float,Tuple[float,float]]
     tol_to_frac_list: Dict[float,List[float]]
 
+    # File each fraction came from, used to resample whole sequences
+    tol_to_file_list: Dict[float,List[str]] = field(default_factory=dict)
+    tol_to_frac_ci: Dict[float,BootstrapCI] = field(default_factory=dict)
+
     @classmethod
-    def from_dict(cls, tol_to_frac_list: Dict[float,List[float]]):
+    def from_dict(cls, tol_to_frac_list: Dict[float,List[float]], tol_to_file_list: Optional[Dict[float,List[str]]] = None):
         tol_to_frac_ave_std = {}
         for tol,frac_list in tol_to_frac_list.items():
             if len(frac_list) == 0:
                 tol_to_frac_ave_std[tol] = (0,0)
             else:
                 tol_to_frac_ave_std[tol] = (np.mean(frac_list, dtype=float), np.std(frac_list, dtype=float))
-        return cls(tol_to_frac_ave_std, tol_to_frac_list)
+        return cls(tol_to_frac_ave_std, tol_to_frac_list, tol_to_file_list or {})
+
+    def bootstrap(self, by_file: bool = False, no_resamples: int = 10000, confidence: float = 0.95, seed: Optional[int] = None, no_workers: int = 1) -> Dict[float,BootstrapCI]:
+        for tol,frac_list in self.tol_to_frac_list.items():
+            if len(frac_list) == 0:
+                continue
+            groups = self.tol_to_file_list.get(tol) if by_file else None
+            assert not by_file or (groups is not None and len(groups) == len(frac_list)), f"No files recorded for the fractions at tol={tol}"
+            self.tol_to_frac_ci[tol] = bootstrap_ci(frac_list, groups, no_resamples=no_resamples, confidence=confidence, seed=seed, no_workers=no_workers)
+        return self.tol_to_frac_ci
 
 
-def measure_tol_to_ave_frac_all_files(file_to_tracks: FileToTracks) -> TolToFrac:
+def measure_tol_to_ave_frac_all_files(file_to_tracks: FileToTracks, checkpoint: Optional[Checkpoint] = None) -> TolToFrac:
     tol_to_frac_list: Dict[float,List[float]] = {}
+    tol_to_file_list: Dict[float,List[str]] = {}
     for fname,tracks in tqdm(file_to_tracks.items(), desc="Measuring linear stats for each file"):
-        tf = measure_tol_to_ave_frac(tracks)
-        for tol,fracs in tf.tol_to_frac_list.items():
+        if checkpoint is not None:
+            # JSON keys are strings, so store (tol, fracs) pairs
+            tol_fracs = checkpoint.compute(f"tol_to_ave_frac/{fname}", lambda: list(measure_tol_to_ave_frac(tracks).tol_to_frac_list.items()))
+        else:
+            tol_fracs = measure_tol_to_ave_frac(tracks).tol_to_frac_list.items()
+        for tol,fracs in tol_fracs:
             tol_to_frac_list.setdefault(tol, []).extend(fracs)
+            tol_to_file_list.setdefault(tol, []).extend([fname] * len(fracs))
 
-    return TolToFrac.from_dict(tol_to_frac_list)
+    return TolToFrac.from_dict(tol_to_frac_list, tol_to_file_list)
 
 
 def measure_tol_to_ave_frac(tracks: Tracks) -> TolToFrac:
@@ -87,10 +123,13 @@ def measure_tol_to_frac_for_track(track: Track) -> Dict[float,float]:
     return tol_to_frac
 
 
-def measure_lin_segments_duration_idxs_all_files(file_to_tracks: FileToTracks, tol: float) -> List[float]:
+def measure_lin_segments_duration_idxs_all_files(file_to_tracks: FileToTracks, tol: float, checkpoint: Optional[Checkpoint] = None) -> List[float]:
     lin_segments_duration_idxs = []
     for fname,tracks in tqdm(file_to_tracks.items(), desc="Measuring linear stats for each file"):
-        lin_segments_duration_idxs += measure_lin_segments_duration_idxs(tracks, tol)
+        if checkpoint is not None:
+            lin_segments_duration_idxs += checkpoint.compute(f"lin_segments_duration_idxs/{tol}/{fname}", lambda: measure_lin_segments_duration_idxs(tracks, tol))
+        else:
+            lin_segments_duration_idxs += measure_lin_segments_duration_idxs(tracks, tol)
     return lin_segments_duration_idxs
 
 
@@ -0,0 +1,110 @@
+from motlinearity.data import Tracks, FileToTracks
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_triplets import LinTripletChecker
+
+
+from typing import List, Optional
+from dataclasses import dataclass
+from tqdm import tqdm
+import numpy as np
+
+
+@dataclass
+class ConfTolToFrac:
+    confs: List[float]
+    tols: List[float]
+
+    # Mean and std over tracks of the fraction of points in linear segments, shape (no confs, no tols)
+    frac_ave: np.ndarray
+    frac_std: np.ndarray
+
+    # Per-track fractions for each conf threshold, shape (no tracks with detections above the threshold, no tols)
+    frac_arrays: List[np.ndarray]
+
+    @classmethod
+    def from_arrays(cls, confs: List[float], tols: List[float], frac_arrays: List[np.ndarray]):
+        frac_ave = np.zeros((len(confs),len(tols)))
+        frac_std = np.zeros((len(confs),len(tols)))
+        for i,fracs in enumerate(frac_arrays):
+            if len(fracs) > 0:
+                frac_ave[i] = np.mean(fracs, axis=0)
+                frac_std[i] = np.std(fracs, axis=0)
+        return cls(confs, tols, frac_ave, frac_std, frac_arrays)
+
+
+def measure_conf_tol_to_frac_packed(packed: PackedTracks, confs: List[float], tols: List[float], checker: Optional[LinTripletChecker] = None) -> ConfTolToFrac:
+    # Fraction of points in linear segments (TOL mode by default) for every pair of confidence threshold and tolerance
+    # Detections below a threshold are dropped before finding linear segments, as if the track never had them
+    # Needs tracker output: raw detections (e.g. MOT det.txt) have track id -1, and would be one pseudo-track per sequence
+    # mixing unrelated boxes of the same frame
+    assert packed.confs is not None, "Tracks have no confidences - load tracker output with confidences"
+    assert np.all(packed.track_ids >= 0), "Detections without track ids (track id < 0, as in MOT det.txt) can not form tracks - use tracker output with real track ids"
+    if checker is None:
+        checker = LinTripletChecker(LinTripletChecker.Options(mode=LinTripletChecker.Options.Mode.TOL))
+    assert checker.options.mode != LinTripletChecker.Options.Mode.PERTURB, "PERTURB mode has no tolerance - use TOL, TOL_CROSS or ANGLE"
+    tols_arr = np.asarray(tols, dtype=float)
+    point_track_idxs = packed.track_idxs()
+
+    # Detections sorted by confidence once; the detections kept at any threshold are a prefix of this order
+    order = np.argsort(-packed.confs, kind="stable")
+    sorted_confs = packed.confs[order]
+
+    # Score (e.g. slope difference) of the triplet centered at each detection, and the neighbors it was computed with
+    # A score is reused at lower thresholds as long as no detection was inserted next to its center
+    cached_prev = np.full(packed.no_points, -1)
+    cached_next = np.full(packed.no_points, -1)
+    cached_scores = np.full(packed.no_points, np.inf)
+
+    frac_arrays = []
+    for conf in sorted(confs, reverse=True):
+        no_kept = np.searchsorted(-sorted_confs, -conf, side="right")
+        kept = np.sort(order[:no_kept])
+        kept_track_idxs = point_track_idxs[kept]
+
+        # Centers of triplets of consecutive kept detections in the same track
+        is_center = np.zeros(len(kept), dtype=bool)
+        if len(kept) >= 3:
+            is_center[1:-1] = (kept_track_idxs[:-2] == kept_track_idxs[1:-1]) & (kept_track_idxs[1:-1] == kept_track_idxs[2:])
+        center_pos = np.nonzero(is_center)[0]
+        centers = kept[center_pos]
+        prevs = kept[center_pos-1]
+        nexts = kept[center_pos+1]
+
+        changed = (cached_prev[centers] != prevs) | (cached_next[centers] != nexts)
+        c, p, n = centers[changed], prevs[changed], nexts[changed]
+        if packed.is_xyxy:
+            cached_scores[c] = checker.xyxy_triplet_scores(packed.data[p], packed.data[c], packed.data[n])
+        else:
+            cached_scores[c] = checker.triplet_scores(packed.data[p], packed.data[c], packed.data[n])
+        cached_prev[c] = p
+        cached_next[c] = n
+
+        # All tolerances at once
+        is_center_linear = np.zeros((len(kept),len(tols_arr)), dtype=bool)
+        is_center_linear[center_pos] = cached_scores[centers][:,None] <= tols_arr[None,:]
+        in_segments = checker.lin_centers_to_points_in_segments(is_center_linear)
+
+        no_kept_per_track = np.bincount(kept_track_idxs, minlength=packed.no_tracks)
+        no_in_segments = np.stack([ np.bincount(kept_track_idxs, weights=in_segments[:,j], minlength=packed.no_tracks) for j in range(len(tols_arr)) ], axis=1)
+        has_points = no_kept_per_track > 0
+        frac_arrays.append(no_in_segments[has_points] / no_kept_per_track[has_points][:,None])
+
+    # Back in the order the thresholds were given
+    conf_order = np.argsort(-np.asarray(confs, dtype=float), kind="stable")
+    frac_arrays_given = [ np.zeros((0,len(tols))) ] * len(confs)
+    for i,j in enumerate(conf_order):
+        frac_arrays_given[j] = frac_arrays[i]
+    return ConfTolToFrac.from_arrays(list(confs), list(tols), frac_arrays_given)
+
+
+def measure_conf_tol_to_frac(tracks: Tracks, confs: List[float], tols: List[float], checker: Optional[LinTripletChecker] = None) -> ConfTolToFrac:
+    return measure_conf_tol_to_frac_packed(PackedTracks.from_tracks(tracks), confs, tols, checker)
+
+
+def measure_conf_tol_to_frac_all_files(file_to_tracks: FileToTracks, confs: List[float], tols: List[float], checker: Optional[LinTripletChecker] = None) -> ConfTolToFrac:
+    frac_arrays = [ [] for _ in confs ]
+    for fname,tracks in tqdm(file_to_tracks.items(), desc="Measuring linear stats by confidence for each file"):
+        ctf = measure_conf_tol_to_frac(tracks, confs, tols, checker)
+        for i,fracs in enumerate(ctf.frac_arrays):
+            frac_arrays[i].append(fracs)
+    return ConfTolToFrac.from_arrays(list(confs), list(tols), [ np.concatenate(fracs, axis=0) for fracs in frac_arrays ])
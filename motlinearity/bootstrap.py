@@ -0,0 +1,85 @@
+from typing import List, Optional, Union
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from mashumaro import DataClassDictMixin
+from loguru import logger
+import numpy as np
+
+
+@dataclass
+class BootstrapCI(DataClassDictMixin):
+    mean: float
+    ci_low: float
+    ci_high: float
+    confidence: float
+    no_resamples: int
+    by_group: bool
+
+
+# Resampling fewer groups than this gives intervals that are too narrow, with one group they have zero width
+_MIN_GROUPS = 5
+
+
+# Max number of resampled indexes held in memory at once per worker
+_MAX_IDXS_PER_BATCH = 10_000_000
+
+
+def _bootstrap_means(sums: np.ndarray, counts: np.ndarray, no_resamples: int, seed: Union[int,np.random.SeedSequence,None]) -> np.ndarray:
+    # Each replicate draws len(sums) units with replacement; the replicate mean is the pooled mean over the drawn units
+    rng = np.random.default_rng(seed)
+    no_units = len(sums)
+    batch_size = max(1, _MAX_IDXS_PER_BATCH // max(no_units, 1))
+
+    means = np.empty(no_resamples)
+    for start in range(0, no_resamples, batch_size):
+        end = min(start + batch_size, no_resamples)
+        idxs = rng.integers(0, no_units, size=(end - start, no_units))
+        means[start:end] = sums[idxs].sum(axis=1) / counts[idxs].sum(axis=1)
+    return means
+
+
+def bootstrap_ci(
+    values: List[float],
+    groups: Optional[List[str]] = None,
+    no_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+    no_workers: int = 1
+    ) -> BootstrapCI:
+    assert len(values) > 0, "No values to resample"
+    assert 0 < confidence < 1, f"Confidence must be in (0,1), got {confidence}"
+    values = np.asarray(values, dtype=float)
+
+    if groups is None:
+        # Resample individual values (tracks)
+        sums = values
+        counts = np.ones(len(values))
+    else:
+        # Resample whole groups (sequences), keeping all values of a drawn group together
+        assert len(groups) == len(values), f"Got {len(groups)} groups for {len(values)} values"
+        _, group_idxs = np.unique(np.asarray(groups), return_inverse=True)
+        sums = np.bincount(group_idxs, weights=values)
+        counts = np.bincount(group_idxs).astype(float)
+        if len(sums) < _MIN_GROUPS:
+            logger.warning(f"Bootstrapping only {len(sums)} groups underestimates the uncertainty - resample values instead (groups=None)")
+
+    if no_workers <= 1:
+        means = _bootstrap_means(sums, counts, no_resamples, seed)
+    else:
+        # Independent streams per worker
+        seeds = np.random.SeedSequence(seed).spawn(no_workers)
+        chunks = [ len(c) for c in np.array_split(np.arange(no_resamples), no_workers) ]
+        with ProcessPoolExecutor(max_workers=no_workers) as executor:
+            futures = [ executor.submit(_bootstrap_means, sums, counts, chunk, s) for chunk,s in zip(chunks,seeds) if chunk > 0 ]
+            means = np.concatenate([ f.result() for f in futures ])
+
+    alpha = 1 - confidence
+    ci_low, ci_high = np.quantile(means, [alpha/2, 1 - alpha/2])
+    return BootstrapCI(
+        mean=float(np.mean(values)),
+        ci_low=float(ci_low),
+        ci_high=float(ci_high),
+        confidence=confidence,
+        no_resamples=no_resamples,
+        by_group=groups is not None
+        )
@@ -0,0 +1,107 @@
+from motlinearity.data import FileToTracks, TracksXyxy, TracksXy
+from motlinearity.data_arrays import PackedTracks
+
+
+from typing import Any, Callable, Dict, Optional
+from loguru import logger
+import numpy as np
+import hashlib
+import tempfile
+import json
+import re
+import os
+
+
+class Checkpoint:
+    # Results of completed units of work (e.g. one sequence), each in its own JSON file
+    # Files are written atomically, so a run that dies leaves only complete results behind
+    # Results are kept in a subdirectory named by a digest of the fingerprint (e.g. the input data and preprocessing
+    # options, see fingerprint_file_to_tracks), so a run on different inputs never resumes from stale results
+
+
+    def __init__(self, checkpoint_dir: str, resume: bool = True, fingerprint: Optional[Dict[str,Any]] = None):
+        self.resume = resume
+        self.fingerprint = fingerprint
+        if fingerprint is not None:
+            fingerprint_json = json.dumps(fingerprint, sort_keys=True)
+            checkpoint_dir = os.path.join(checkpoint_dir, hashlib.sha1(fingerprint_json.encode("utf-8")).hexdigest()[:16])
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        if fingerprint is not None:
+            self._write_manifest(fingerprint)
+
+
+    def _write_manifest(self, fingerprint: Dict[str,Any]):
+        # Records what the results were computed from, for inspection
+        fname = os.path.join(self.checkpoint_dir, "manifest.json")
+        if os.path.exists(fname):
+            with open(fname, "r") as f:
+                assert json.load(f) == json.loads(json.dumps(fingerprint)), f"Manifest {fname} does not match the fingerprint of its directory"
+            return
+        with open(fname, "w") as f:
+            json.dump(fingerprint, f, indent=2, sort_keys=True)
+
+
+    def fname(self, unit: str) -> str:
+        # Readable and unique file name for any unit name
+        safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", unit)[:100]
+        digest = hashlib.sha1(unit.encode("utf-8")).hexdigest()[:10]
+        return os.path.join(self.checkpoint_dir, f"{safe}_{digest}.json")
+
+
+    def has(self, unit: str) -> bool:
+        return self.resume and os.path.exists(self.fname(unit))
+
+
+    def load(self, unit: str) -> Any:
+        with open(self.fname(unit), "r") as f:
+            return json.load(f)["result"]
+
+
+    def save(self, unit: str, result: Any):
+        fd, tmp_fname = tempfile.mkstemp(suffix=".tmp", dir=self.checkpoint_dir)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({ "unit": unit, "result": result }, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_fname, self.fname(unit))
+        except BaseException:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            raise
+
+
+    def compute(self, unit: str, fn: Callable[[],Any]) -> Any:
+        # Load the result of the unit if it was completed before, else compute and save it
+        # The result must be JSON serializable
+        if self.has(unit):
+            logger.debug(f"Resuming {unit} from {self.fname(unit)}")
+            return self.load(unit)
+        result = fn()
+        self.save(unit, result)
+        return result
+
+
+def fingerprint_file_to_tracks(file_to_tracks: FileToTracks) -> str:
+    # Digest of the track ids, frame ids, data and interpolated points of all files, to tell inputs apart in checkpoint fingerprints
+    digest = hashlib.sha1()
+    for fname in sorted(file_to_tracks):
+        packed = PackedTracks.from_tracks(file_to_tracks[fname])
+        digest.update(fname.encode("utf-8"))
+        for arr in [packed.track_ids, packed.offsets, packed.frame_ids, packed.data, packed.observed()]:
+            digest.update(str(arr.shape).encode("utf-8"))
+            digest.update(np.ascontiguousarray(arr).tobytes())
+    return digest.hexdigest()
+
+
+def chunk_file_to_tracks(file_to_tracks: FileToTracks, chunk_size: int) -> FileToTracks:
+    # Split every file into chunks of at most chunk_size tracks, so that large files are checkpointed in parts
+    assert chunk_size > 0, f"Chunk size must be positive, got {chunk_size}"
+    chunked = {}
+    for fname,tracks in file_to_tracks.items():
+        track_ids = list(tracks.tracks.keys())
+        for i in range(0, max(len(track_ids), 1), chunk_size):
+            chunk = { track_id: tracks.tracks[track_id] for track_id in track_ids[i:i+chunk_size] }
+            chunked[f"{fname}/{i // chunk_size}"] = TracksXyxy(chunk) if type(tracks) == TracksXyxy else TracksXy(chunk)
+    return chunked
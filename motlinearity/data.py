@@ -1,10 +1,13 @@
 from dataclasses import dataclass
 from mashumaro import DataClassDictMixin
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed
 import glob
 import os
+import time
 from typing import List, Optional, Dict, Tuple, Union
 from enum import Enum
 from tqdm import tqdm
+from loguru import logger
 import numpy as np
 
 
@@ -17,18 +20,17 @@ class Entry(DataClassDictMixin):
     conf: Optional[float] = None
     consider: Optional[bool] = None
 
+    # Filled in by resampling onto consecutive frames, not measured
+    is_interpolated: bool = False
 
-def length_boxes_center(boxes: List[Entry]) -> float:
-    dist_center = 0
-    for i in range(len(boxes)-1):
-        xyxy1 = boxes[i].data
-        xyxy2 = boxes[i+1].data
-
-        center1 = [(xyxy1[0] + xyxy1[2]) / 2, (xyxy1[1] + xyxy1[3]) / 2]
-        center2 = [(xyxy2[0] + xyxy2[2]) / 2, (xyxy2[1] + xyxy2[3]) / 2]
-        dist_center += ((center1[0] - center2[0])**2 + (center1[1] - center2[1])**2)**0.5
 
-    return dist_center
+def length_boxes_center(boxes: List[Entry]) -> float:
+    if len(boxes) < 2:
+        return 0
+    xyxys = np.array([ box.data for box in boxes ], dtype=float)
+    centers = 0.5 * (xyxys[:,:2] + xyxys[:,2:])
+    disps = np.diff(centers, axis=0)
+    return float(np.sum(np.hypot(disps[:,0], disps[:,1])))
 
 
 @dataclass
@@ -80,14 +82,17 @@ def parse_line(s: str, is_gt: bool) -> Entry:
         data=xyxy,
         is_gt=is_gt,
         conf=float(consider_entry_or_conf) if not is_gt else None,
-        consider=bool(consider_entry_or_conf) if is_gt else None
+        consider=bool(int(float(consider_entry_or_conf))) if is_gt else None
         )
 
 
 def read_file(fname: str, is_gt: bool) -> TracksXyxy:
     with open(fname, "r") as f:
-        lines = f.readlines()
-    boxes = [parse_line(line, is_gt) for line in lines]
+        return parse_file(f.read(), is_gt)
+
+
+def parse_file(text: str, is_gt: bool) -> TracksXyxy:
+    boxes = [parse_line(line, is_gt) for line in text.splitlines() if line.strip()]
 
     tracks = TracksXyxy({})
     for box in boxes:
@@ -135,23 +140,127 @@ class DataSpec(DataClassDictMixin):
         else:
             raise NotImplementedError(f"Unknown MOT dataset {self.mot}")
 
+    @property
+    def fnames_glob(self):
+        if self.mot == self.Mot.MOT17:
+            return os.path.join(self.mot_dir, self.split.value, "*-%s" % self.mot17_method.value, self.mode.value, "%s.txt" % self.mode.value)
+        elif self.mot == self.Mot.MOT20:
+            return os.path.join(self.mot_dir, self.split.value, "*", self.mode.value, "%s.txt" % self.mode.value)
+        else:
+            raise NotImplementedError(f"Unknown MOT dataset {self.mot}")
+
+
+def seq_name_from_fname(fname: str) -> str:
+    # Labels are in <seq>/<mode>/<mode>.txt
+    return os.path.basename(os.path.dirname(os.path.dirname(fname)))
+
 
 def load_tracks(spec: DataSpec) -> Dict[str, TracksXyxy]:
-    if spec.mot == DataSpec.Mot.MOT17:
-        fnames_glob = os.path.join(spec.mot_dir, spec.split.value, "*-%s" % spec.mot17_method.value, spec.mode.value, "%s.txt" % spec.mode.value)
-    elif spec.mot == DataSpec.Mot.MOT20:
-        fnames_glob = os.path.join(spec.mot_dir, spec.split.value, "*", spec.mode.value, "%s.txt" % spec.mode.value)
-    else:
-        raise NotImplementedError(f"Unknown MOT dataset {spec.mot}")
-    fnames = glob.glob(fnames_glob)
-    assert len(fnames) > 0, f"No files found in {fnames_glob}"
+    fnames = glob.glob(spec.fnames_glob)
+    assert len(fnames) > 0, f"No files found in {spec.fnames_glob}"
 
     tracks = {}
     for fname in fnames:
-        tracks[os.path.basename(os.path.dirname(os.path.dirname(fname)))] = read_file(fname, spec.mode == "gt")
+        tracks[seq_name_from_fname(fname)] = read_file(fname, spec.mode == DataSpec.Mode.GT)
     return tracks
 
 
+@dataclass
+class LoadError:
+    fname: str
+    error: str
+
+
+@dataclass
+class LoadResult:
+    spec: DataSpec
+    file_to_tracks: Dict[str, TracksXyxy]
+    errors: List[LoadError]
+    no_bytes: int = 0
+
+
+def _read_text(fname: str) -> str:
+    with open(fname, "r") as f:
+        return f.read()
+
+
+def _read_and_parse(fname: str, is_gt: bool) -> Tuple[int,Optional[TracksXyxy],Optional[str]]:
+    # Bytes read, and the tracks or the parse error, so the bytes of files failing to parse are still counted
+    text = _read_text(fname)
+    try:
+        return len(text), parse_file(text, is_gt), None
+    except Exception as e:
+        return len(text), None, repr(e)
+
+
+def load_tracks_parallel(specs: List[DataSpec], no_io_workers: int = 8, no_parse_workers: int = 0) -> List[LoadResult]:
+    # Files of all specs are read by a thread pool; each file is parsed as soon as it has been read,
+    # in a process pool if no_parse_workers > 0, else in the same pool thread that read it
+    # Errors are recorded per file instead of aborting the whole load
+    results = [ LoadResult(spec=spec, file_to_tracks={}, errors=[]) for spec in specs ]
+    jobs: List[Tuple[int,str]] = []
+    for i,spec in enumerate(specs):
+        fnames = sorted(glob.glob(spec.fnames_glob))
+        if len(fnames) == 0:
+            results[i].errors.append(LoadError(fname=spec.fnames_glob, error="No files found"))
+        jobs += [ (i,fname) for fname in fnames ]
+
+    parse_executor = ProcessPoolExecutor(max_workers=no_parse_workers) if no_parse_workers > 0 else None
+    try:
+        with ThreadPoolExecutor(max_workers=max(no_io_workers, 1)) as io_executor:
+            if parse_executor is not None:
+                read_futures: Dict[Future,Tuple[int,str]] = { io_executor.submit(_read_text, fname): (i,fname) for i,fname in jobs }
+            else:
+                read_futures = { io_executor.submit(_read_and_parse, fname, specs[i].mode == DataSpec.Mode.GT): (i,fname) for i,fname in jobs }
+            parse_futures: Dict[Future,Tuple[int,str]] = {}
+            for future in tqdm(as_completed(read_futures), total=len(read_futures), desc="Reading files"):
+                i,fname = read_futures[future]
+                try:
+                    if parse_executor is not None:
+                        text = future.result()
+                        results[i].no_bytes += len(text)
+                        parse_futures[parse_executor.submit(parse_file, text, specs[i].mode == DataSpec.Mode.GT)] = (i,fname)
+                    else:
+                        no_bytes, tracks, error = future.result()
+                        results[i].no_bytes += no_bytes
+                        if error is not None:
+                            results[i].errors.append(LoadError(fname=fname, error=error))
+                        else:
+                            results[i].file_to_tracks[seq_name_from_fname(fname)] = tracks
+                except Exception as e:
+                    results[i].errors.append(LoadError(fname=fname, error=repr(e)))
+
+            for future in as_completed(parse_futures):
+                i,fname = parse_futures[future]
+                try:
+                    results[i].file_to_tracks[seq_name_from_fname(fname)] = future.result()
+                except Exception as e:
+                    results[i].errors.append(LoadError(fname=fname, error=repr(e)))
+    finally:
+        if parse_executor is not None:
+            parse_executor.shutdown()
+
+    # Files complete in any order; sort them so results do not depend on timing
+    for result in results:
+        result.file_to_tracks = dict(sorted(result.file_to_tracks.items()))
+        for error in result.errors:
+            logger.warning(f"Failed to load {error.fname}: {error.error}")
+    return results
+
+
+def benchmark_load_tracks(specs: List[DataSpec], no_workers_list: List[int], parse_in_processes: bool = False) -> Dict[int,float]:
+    # Throughput in MB/s for each number of workers
+    no_workers_to_mb_per_sec = {}
+    for no_workers in no_workers_list:
+        start = time.perf_counter()
+        results = load_tracks_parallel(specs, no_io_workers=no_workers, no_parse_workers=no_workers if parse_in_processes else 0)
+        duration = time.perf_counter() - start
+        no_bytes = sum(result.no_bytes for result in results)
+        no_workers_to_mb_per_sec[no_workers] = no_bytes / 1e6 / duration
+        logger.info(f"Loaded {no_bytes / 1e6:.1f} MB with {no_workers} workers in {duration:.2f} s = {no_workers_to_mb_per_sec[no_workers]:.1f} MB/s")
+    return no_workers_to_mb_per_sec
+
+
 
 @dataclass
 class DispProb(DataClassDictMixin):
@@ -0,0 +1,114 @@
+from motlinearity.data import Entry, TrackXyxy, TrackXy, TracksXyxy, TracksXy, Tracks
+
+
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+
+@dataclass
+class PackedTracks:
+    # All tracks of a sequence concatenated into flat arrays
+    # Points of track i are data[offsets[i]:offsets[i+1]], sorted by frame_id
+    track_ids: np.ndarray
+    offsets: np.ndarray
+    frame_ids: np.ndarray
+    data: np.ndarray
+    confs: Optional[np.ndarray] = None
+    is_gt: bool = True
+
+    # Id of the original track each track was cut from, if tracks were split
+    parent_track_ids: Optional[np.ndarray] = None
+
+    # Mask over points filled in by resampling, which are never centers of linear triplets and are not counted in stats
+    is_interpolated: Optional[np.ndarray] = None
+
+    @property
+    def no_tracks(self) -> int:
+        return len(self.track_ids)
+
+    @property
+    def no_points(self) -> int:
+        return len(self.data)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def is_xyxy(self) -> bool:
+        return self.data.shape[1] == 4
+
+    def track_idxs(self) -> np.ndarray:
+        # Index (not id) of the track each point belongs to
+        return np.repeat(np.arange(self.no_tracks), self.lengths)
+
+    def same_track_as_next(self) -> np.ndarray:
+        # Mask over the N-1 steps between consecutive points: True if both points are in the same track
+        track_idxs = self.track_idxs()
+        return track_idxs[1:] == track_idxs[:-1]
+
+    def observed(self) -> np.ndarray:
+        # Mask over points measured in the data
+        if self.is_interpolated is None:
+            return np.ones(self.no_points, dtype=bool)
+        return ~self.is_interpolated
+
+    def centers(self) -> np.ndarray:
+        if self.is_xyxy:
+            return 0.5 * (self.data[:,:2] + self.data[:,2:])
+        return self.data
+
+    def track_slice(self, i: int) -> slice:
+        return slice(int(self.offsets[i]), int(self.offsets[i+1]))
+
+    @classmethod
+    def from_tracks(cls, tracks: Tracks):
+        track_list = list(tracks.tracks.values())
+        lengths = np.array([ len(track.entries) for track in track_list ], dtype=np.int64)
+        offsets = np.zeros(len(track_list)+1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        entries = [ entry for track in track_list for entry in track.entries ]
+        no_dims = 4 if type(tracks) == TracksXyxy else 2
+        data = np.array([ entry.data for entry in entries ], dtype=float).reshape(-1, no_dims)
+        frame_ids = np.array([ entry.frame_id for entry in entries ], dtype=np.int64)
+
+        confs = None
+        if any(entry.conf is not None for entry in entries):
+            confs = np.array([ entry.conf if entry.conf is not None else np.nan for entry in entries ], dtype=float)
+
+        is_interpolated = None
+        if any(entry.is_interpolated for entry in entries):
+            is_interpolated = np.array([ entry.is_interpolated for entry in entries ], dtype=bool)
+
+        is_gt = all(track.is_gt for track in track_list) if type(tracks) == TracksXyxy else True
+        return cls(
+            track_ids=np.array([ track.track_id for track in track_list ], dtype=np.int64),
+            offsets=offsets,
+            frame_ids=frame_ids,
+            data=data,
+            confs=confs,
+            is_gt=is_gt,
+            is_interpolated=is_interpolated
+            )
+
+    def to_tracks(self) -> Tracks:
+        tracks = TracksXyxy({}) if self.is_xyxy else TracksXy({})
+        for i,track_id in enumerate(self.track_ids):
+            track_id = int(track_id)
+            entries = []
+            for j in range(self.offsets[i], self.offsets[i+1]):
+                entries.append(Entry(
+                    frame_id=int(self.frame_ids[j]),
+                    track_id=track_id,
+                    data=[ float(z) for z in self.data[j] ],
+                    is_gt=self.is_gt,
+                    conf=float(self.confs[j]) if self.confs is not None and not np.isnan(self.confs[j]) else None,
+                    is_interpolated=bool(self.is_interpolated[j]) if self.is_interpolated is not None else False
+                    ))
+            if self.is_xyxy:
+                tracks.tracks[track_id] = TrackXyxy(track_id=track_id, entries=entries, is_gt=self.is_gt)
+            else:
+                tracks.tracks[track_id] = TrackXy(track_id=track_id, entries=entries)
+        return tracks
@@ -1,7 +1,7 @@
 from motlinearity.lin_detection_triplets import LinSeg
 
 
-from typing import List
+from typing import List, Optional
 from dataclasses import dataclass
 from loguru import logger
 import numpy as np
@@ -12,6 +12,7 @@ class LinStats:
     track_id: int
     no_lin_segments: int
 
+    # Points and durations only count observed points, not those filled in by resampling
     no_points_in_lin_segments: int
     no_points_in_track: int
     frac_of_points_in_linear_segments: float
@@ -19,6 +20,11 @@ class LinStats:
     lin_segments_duration_idxs: List[int]
     lin_segments_mean_duration_idxs: float
     lin_segments_std_duration_idxs: float
+
+    # Durations counted in frames, which differ from idxs if the track skips frames
+    lin_segments_duration_frames: List[int]
+    lin_segments_mean_duration_frames: float
+    lin_segments_std_duration_frames: float
     
     def report(self):
         logger.info(f"Track {self.track_id} has {self.no_lin_segments} linear segments:")
@@ -28,6 +34,7 @@ class LinStats:
         logger.info(f"  Frac of points in linear segments: {self.frac_of_points_in_linear_segments:.2f}")
 
         logger.info(f"  Ave duration of linear segments: {self.lin_segments_mean_duration_idxs:.2f} +- {self.lin_segments_std_duration_idxs:.2f} (idxs)")
+        logger.info(f"  Ave duration of linear segments: {self.lin_segments_mean_duration_frames:.2f} +- {self.lin_segments_std_duration_frames:.2f} (frames)")
 
 
 @dataclass
@@ -36,25 +43,50 @@ class LinSegs:
     no_points_in_track: int
     track_id: int
 
+    # Frame id of each point in the track, if known
+    frame_ids: Optional[List[int]] = None
+
+    # Whether each point was filled in by resampling, if known; stats only count observed points
+    is_interpolated: Optional[List[bool]] = None
+
     @property
     def idxs_in_lin_segments(self) -> List[int]:
         return sorted(list(set([ idx for seg in self.segments for idx in range(seg.idx_start_incl, seg.idx_end_incl+1) ])))
 
+    def _is_observed(self, idx: int) -> bool:
+        return self.is_interpolated is None or not self.is_interpolated[idx]
+
+    def _observed_idxs(self, seg: LinSeg) -> List[int]:
+        return [ idx for idx in range(seg.idx_start_incl, seg.idx_end_incl+1) if self._is_observed(idx) ]
+
     def stats(self) -> LinStats:        
-        no_points_in_linear_segments = len(self.idxs_in_lin_segments)
-        frac_of_points_in_linear_segments = no_points_in_linear_segments / self.no_points_in_track if self.no_points_in_track > 0 else 0
+        no_points_in_linear_segments = len([ idx for idx in self.idxs_in_lin_segments if self._is_observed(idx) ])
+        no_points_in_track = len([ idx for idx in range(self.no_points_in_track) if self._is_observed(idx) ])
+        frac_of_points_in_linear_segments = no_points_in_linear_segments / no_points_in_track if no_points_in_track > 0 else 0
 
-        lin_segments_duration_idxs = [seg.idx_end_incl - seg.idx_start_incl + 1 for seg in self.segments]
+        # Segments always have an observed point, their center
+        seg_observed_idxs = [ self._observed_idxs(seg) for seg in self.segments ]
+        lin_segments_duration_idxs = [ len(idxs) for idxs in seg_observed_idxs ]
         lin_segments_mean_duration_idxs = np.mean(lin_segments_duration_idxs,dtype=float) if len(lin_segments_duration_idxs) > 0 else 0
         lin_segments_std_duration_idxs = np.std(lin_segments_duration_idxs,dtype=float) if len(lin_segments_duration_idxs) > 0 else 0
 
+        if self.frame_ids is not None:
+            lin_segments_duration_frames = [self.frame_ids[idxs[-1]] - self.frame_ids[idxs[0]] + 1 for idxs in seg_observed_idxs]
+        else:
+            lin_segments_duration_frames = lin_segments_duration_idxs
+        lin_segments_mean_duration_frames = np.mean(lin_segments_duration_frames,dtype=float) if len(lin_segments_duration_frames) > 0 else 0
+        lin_segments_std_duration_frames = np.std(lin_segments_duration_frames,dtype=float) if len(lin_segments_duration_frames) > 0 else 0
+
         return LinStats(
             track_id=self.track_id,
             no_lin_segments=len(self.segments),
             no_points_in_lin_segments=no_points_in_linear_segments,
-            no_points_in_track=self.no_points_in_track,
+            no_points_in_track=no_points_in_track,
             frac_of_points_in_linear_segments=frac_of_points_in_linear_segments,
             lin_segments_duration_idxs=lin_segments_duration_idxs,
             lin_segments_mean_duration_idxs=lin_segments_mean_duration_idxs,
             lin_segments_std_duration_idxs=lin_segments_std_duration_idxs,
+            lin_segments_duration_frames=lin_segments_duration_frames,
+            lin_segments_mean_duration_frames=lin_segments_mean_duration_frames,
+            lin_segments_std_duration_frames=lin_segments_std_duration_frames,
             )
\ No newline at end of file
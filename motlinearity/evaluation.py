@@ -0,0 +1,170 @@
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.data_lin import LinSegs
+from motlinearity.lin_detection_triplets import LinTripletChecker
+from motlinearity.lin_detection_packed import find_linear_centers_packed, center_mask_to_segment_bounds, segment_bounds_to_mask
+
+
+from typing import List, Optional, Tuple
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from mashumaro import DataClassDictMixin
+import numpy as np
+import time
+
+
+def lin_segs_to_segment_bounds(packed: PackedTracks, lin_segs_list: List[LinSegs]) -> Tuple[np.ndarray,np.ndarray]:
+    # Segments of LinSegs of the tracks of packed (e.g. from find_linear_segments or annotations) as packed point idxs
+    track_id_to_offset = { int(track_id): int(offset) for track_id,offset in zip(packed.track_ids, packed.offsets[:-1]) }
+    starts = []
+    ends = []
+    for lin_segs in lin_segs_list:
+        offset = track_id_to_offset[lin_segs.track_id]
+        starts += [ offset + seg.idx_start_incl for seg in lin_segs.segments ]
+        ends += [ offset + seg.idx_end_incl for seg in lin_segs.segments ]
+    order = np.argsort(starts, kind="stable")
+    return np.array(starts, dtype=np.int64)[order], np.array(ends, dtype=np.int64)[order]
+
+
+def match_segments(det_starts: np.ndarray, det_ends: np.ndarray, ref_starts: np.ndarray, ref_ends: np.ndarray, iou_thresh: float = 0.5) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+    # One-to-one matches (det idxs, ref idxs, ious) of segments whose interval IoU over points is at least iou_thresh
+    # Both sets must be sorted by start and may only overlap at their ends, so every detected segment overlaps
+    # a contiguous range of reference segments, found by binary search
+    first = np.searchsorted(ref_ends, det_starts, side="left")
+    last = np.searchsorted(ref_starts, det_ends, side="right")
+    no_candidates = np.maximum(last - first, 0)
+    det_idxs = np.repeat(np.arange(len(det_starts)), no_candidates)
+    ref_idxs = np.arange(len(det_idxs)) - np.repeat(np.cumsum(no_candidates) - no_candidates, no_candidates) + np.repeat(first, no_candidates)
+
+    inter = np.minimum(det_ends[det_idxs], ref_ends[ref_idxs]) - np.maximum(det_starts[det_idxs], ref_starts[ref_idxs]) + 1
+    union = (det_ends[det_idxs] - det_starts[det_idxs] + 1) + (ref_ends[ref_idxs] - ref_starts[ref_idxs] + 1) - inter
+    ious = inter / union
+    keep = ious >= iou_thresh
+    det_idxs, ref_idxs, ious = det_idxs[keep], ref_idxs[keep], ious[keep]
+
+    # Segments of one set share at most their end points, so a segment overlapping two others has IoU at most 0.6
+    # with one of them (e.g. [0,4] with [0,2] and [2,4]); above 0.6 every segment has at most one partner,
+    # otherwise match greedily by decreasing IoU
+    if iou_thresh <= 0.6 and len(ious) > 0:
+        det_used = np.zeros(len(det_starts), dtype=bool)
+        ref_used = np.zeros(len(ref_starts), dtype=bool)
+        matched = []
+        for k in np.argsort(-ious, kind="stable"):
+            if not det_used[det_idxs[k]] and not ref_used[ref_idxs[k]]:
+                det_used[det_idxs[k]] = True
+                ref_used[ref_idxs[k]] = True
+                matched.append(k)
+        matched = np.sort(np.array(matched, dtype=np.int64))
+        det_idxs, ref_idxs, ious = det_idxs[matched], ref_idxs[matched], ious[matched]
+    return det_idxs, ref_idxs, ious
+
+
+def _prf(no_tp: int, no_det: int, no_ref: int) -> Tuple[float,float,float]:
+    precision = no_tp / no_det if no_det > 0 else 1.0
+    recall = no_tp / no_ref if no_ref > 0 else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return precision, recall, f1
+
+
+@dataclass
+class SegmentScores(DataClassDictMixin):
+    iou_thresh: float
+    no_det_segments: int
+    no_ref_segments: int
+    no_matched_segments: int
+    mean_matched_iou: float
+    seg_precision: float
+    seg_recall: float
+    seg_f1: float
+
+    # Points in segments
+    point_precision: float
+    point_recall: float
+    point_f1: float
+
+
+def score_segments(det_starts: np.ndarray, det_ends: np.ndarray, ref_starts: np.ndarray, ref_ends: np.ndarray, no_points: int, iou_thresh: float = 0.5) -> SegmentScores:
+    _, _, ious = match_segments(det_starts, det_ends, ref_starts, ref_ends, iou_thresh)
+    seg_precision, seg_recall, seg_f1 = _prf(len(ious), len(det_starts), len(ref_starts))
+
+    det_in = segment_bounds_to_mask(det_starts, det_ends, no_points)
+    ref_in = segment_bounds_to_mask(ref_starts, ref_ends, no_points)
+    point_precision, point_recall, point_f1 = _prf(int(np.sum(det_in & ref_in)), int(np.sum(det_in)), int(np.sum(ref_in)))
+
+    return SegmentScores(
+        iou_thresh=iou_thresh,
+        no_det_segments=len(det_starts),
+        no_ref_segments=len(ref_starts),
+        no_matched_segments=len(ious),
+        mean_matched_iou=float(np.mean(ious)) if len(ious) > 0 else 0.0,
+        seg_precision=seg_precision,
+        seg_recall=seg_recall,
+        seg_f1=seg_f1,
+        point_precision=point_precision,
+        point_recall=point_recall,
+        point_f1=point_f1
+        )
+
+
+@dataclass
+class DetectorEval(DataClassDictMixin):
+    options: LinTripletChecker.Options
+    scores: SegmentScores
+    no_points: int
+
+    # Best of the repeated runs of the detection, from points to segment bounds
+    duration_sec: float
+    points_per_sec: float
+
+
+def evaluate_detector_packed(packed: PackedTracks, ref_starts: np.ndarray, ref_ends: np.ndarray, options: LinTripletChecker.Options, iou_thresh: float = 0.5, no_repeats: int = 3) -> DetectorEval:
+    checker = LinTripletChecker(options)
+    duration_sec = np.inf
+    for _ in range(max(no_repeats, 1)):
+        start = time.perf_counter()
+        det_starts, det_ends = center_mask_to_segment_bounds(find_linear_centers_packed(packed, checker))
+        duration_sec = min(duration_sec, time.perf_counter() - start)
+
+    return DetectorEval(
+        options=options,
+        scores=score_segments(det_starts, det_ends, np.asarray(ref_starts), np.asarray(ref_ends), packed.no_points, iou_thresh),
+        no_points=packed.no_points,
+        duration_sec=duration_sec,
+        points_per_sec=packed.no_points / duration_sec if duration_sec > 0 else np.inf
+        )
+
+
+_worker_eval_data: Optional[Tuple[PackedTracks,np.ndarray,np.ndarray]] = None
+
+
+def _init_eval_worker(packed: PackedTracks, ref_starts: np.ndarray, ref_ends: np.ndarray):
+    global _worker_eval_data
+    _worker_eval_data = (packed, ref_starts, ref_ends)
+
+
+def _evaluate_in_worker(options: LinTripletChecker.Options, iou_thresh: float, no_repeats: int) -> DetectorEval:
+    packed, ref_starts, ref_ends = _worker_eval_data
+    return evaluate_detector_packed(packed, ref_starts, ref_ends, options, iou_thresh, no_repeats)
+
+
+def evaluate_detector_grid(
+    packed: PackedTracks,
+    ref_starts: np.ndarray,
+    ref_ends: np.ndarray,
+    options_list: List[LinTripletChecker.Options],
+    iou_thresh: float = 0.5,
+    no_repeats: int = 3,
+    no_workers: int = 1
+    ) -> List[DetectorEval]:
+    # Evaluate each configuration, in parallel if no_workers > 1; the data is sent once to each worker
+    # Parallel timings share the machine, so compare throughputs measured with the same no_workers
+    if no_workers <= 1:
+        return [ evaluate_detector_packed(packed, ref_starts, ref_ends, options, iou_thresh, no_repeats) for options in options_list ]
+    with ProcessPoolExecutor(max_workers=no_workers, initializer=_init_eval_worker, initargs=(packed, ref_starts, ref_ends)) as executor:
+        futures = [ executor.submit(_evaluate_in_worker, options, iou_thresh, no_repeats) for options in options_list ]
+        return [ f.result() for f in futures ]
+
+
+def fastest_detector(evals: List[DetectorEval], min_f1: float, point_level: bool = False) -> Optional[DetectorEval]:
+    # Fastest configuration whose segment (or point) F1 reaches min_f1, None if none does
+    passing = [ e for e in evals if (e.scores.point_f1 if point_level else e.scores.seg_f1) >= min_f1 ]
+    return max(passing, key=lambda e: e.points_per_sec) if len(passing) > 0 else None
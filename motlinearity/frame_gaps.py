@@ -0,0 +1,98 @@
+from motlinearity.data import Tracks
+from motlinearity.data_arrays import PackedTracks
+
+
+from typing import Optional
+import numpy as np
+
+
+def split_packed_at_frame_gaps(packed: PackedTracks, max_gap: int) -> PackedTracks:
+    # Cut tracks wherever consecutive points are more than max_gap frames apart
+    # The first piece of a track keeps its id, further pieces get new ids above all existing ids
+    assert max_gap >= 1, f"Max frame gap must be at least 1, got {max_gap}"
+    parent_idxs = packed.track_idxs()
+    is_start = np.ones(packed.no_points, dtype=bool)
+    is_start[1:] = ~packed.same_track_as_next() | (np.diff(packed.frame_ids) > max_gap)
+
+    starts = np.nonzero(is_start)[0]
+    offsets = np.append(starts, packed.no_points).astype(np.int64)
+    piece_parent_idxs = parent_idxs[starts]
+
+    # Pieces after the first of each track
+    is_first_piece = np.ones(len(starts), dtype=bool)
+    is_first_piece[1:] = piece_parent_idxs[1:] != piece_parent_idxs[:-1]
+    next_id = int(packed.track_ids.max()) + 1 if packed.no_tracks > 0 else 0
+    parent_track_ids = packed.track_ids[piece_parent_idxs] if packed.parent_track_ids is None else packed.parent_track_ids[piece_parent_idxs]
+    track_ids = packed.track_ids[piece_parent_idxs].copy()
+    track_ids[~is_first_piece] = next_id + np.arange(np.count_nonzero(~is_first_piece))
+
+    return PackedTracks(
+        track_ids=track_ids,
+        offsets=offsets,
+        frame_ids=packed.frame_ids,
+        data=packed.data,
+        confs=packed.confs,
+        is_gt=packed.is_gt,
+        parent_track_ids=parent_track_ids,
+        is_interpolated=packed.is_interpolated
+        )
+
+
+def resample_packed_to_frame_grid(packed: PackedTracks, max_gap: Optional[int] = None) -> PackedTracks:
+    # Linearly interpolate every track onto consecutive frames
+    # If max_gap is given, tracks are first split at larger gaps, which are not filled
+    # Filled points lie on the line between their neighbours, so they are marked in is_interpolated and are never
+    # centers of linear triplets, else resampling would make up linearity that is not in the data
+    if max_gap is not None:
+        packed = split_packed_at_frame_gaps(packed, max_gap)
+    if packed.no_points == 0:
+        return packed
+
+    first_frames = packed.frame_ids[packed.offsets[:-1]]
+    last_frames = packed.frame_ids[packed.offsets[1:] - 1]
+    new_lengths = (last_frames - first_frames + 1).astype(np.int64)
+    new_offsets = np.zeros(packed.no_tracks+1, dtype=np.int64)
+    np.cumsum(new_lengths, out=new_offsets[1:])
+
+    new_track_idxs = np.repeat(np.arange(packed.no_tracks), new_lengths)
+    new_frame_ids = np.repeat(first_frames, new_lengths) + (np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1], new_lengths))
+
+    # Keys sorted over the whole packed array since points are grouped by track and sorted by frame within
+    min_frame = int(packed.frame_ids.min())
+    stride = int(packed.frame_ids.max()) - min_frame + 1
+    src_keys = packed.track_idxs() * stride + (packed.frame_ids - min_frame)
+    new_keys = new_track_idxs * stride + (new_frame_ids - min_frame)
+
+    # Source points to the left and right of each new point, within the same track
+    left = np.searchsorted(src_keys, new_keys, side="right") - 1
+    right = np.minimum(left + 1, packed.offsets[1:][new_track_idxs] - 1)
+    delta_frames = packed.frame_ids[right] - packed.frame_ids[left]
+    weights = np.zeros(len(left))
+    np.divide(new_frame_ids - packed.frame_ids[left], delta_frames, out=weights, where=delta_frames > 0)
+    data = (1 - weights)[:,None] * packed.data[left] + weights[:,None] * packed.data[right]
+
+    # Points of missing frames are marked interpolated, and have no confidence
+    is_source = packed.frame_ids[left] == new_frame_ids
+    is_interpolated = ~is_source if packed.is_interpolated is None else ~is_source | packed.is_interpolated[left]
+    confs = None
+    if packed.confs is not None:
+        confs = np.where(is_source, packed.confs[left], np.nan)
+
+    return PackedTracks(
+        track_ids=packed.track_ids,
+        offsets=new_offsets,
+        frame_ids=new_frame_ids,
+        data=data,
+        confs=confs,
+        is_gt=packed.is_gt,
+        parent_track_ids=packed.parent_track_ids,
+        is_interpolated=is_interpolated
+        )
+
+
+def split_tracks_at_frame_gaps(tracks: Tracks, max_gap: int) -> Tracks:
+    return split_packed_at_frame_gaps(PackedTracks.from_tracks(tracks), max_gap).to_tracks()
+
+
+def resample_tracks_to_frame_grid(tracks: Tracks, max_gap: Optional[int] = None) -> Tracks:
+    return resample_packed_to_frame_grid(PackedTracks.from_tracks(tracks), max_gap).to_tracks()
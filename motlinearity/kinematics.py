@@ -0,0 +1,133 @@
+from motlinearity.data import Tracks, FileToTracks
+from motlinearity.data_arrays import PackedTracks
+
+
+from typing import List, Dict, Tuple
+from dataclasses import dataclass
+from tqdm import tqdm
+import numpy as np
+
+
+@dataclass
+class TrackKinematics:
+    track_id: int
+    path_length_center: float
+    mean_speed: float
+    mean_abs_accel: float
+    mean_abs_heading_change: float
+    mean_abs_curvature: float
+
+
+@dataclass
+class Kinematics:
+    # Per-track path length of the box center (pixels)
+    track_ids: np.ndarray
+    path_length_center: np.ndarray
+
+    # Per-step velocities of the box center (pixels / frame), flattened over all tracks
+    velocities: np.ndarray
+    velocity_track_idxs: np.ndarray
+
+    # Per-turn quantities (two consecutive steps in the same track), flattened over all tracks
+    # Accelerations in pixels / frame^2, heading changes in radians in (-pi,pi], curvatures in radians / pixel
+    # Heading change and curvature are nan if either step has zero length
+    accelerations: np.ndarray
+    heading_changes: np.ndarray
+    curvatures: np.ndarray
+    turn_track_idxs: np.ndarray
+
+    @property
+    def no_tracks(self) -> int:
+        return len(self.track_ids)
+
+    def _mean_per_track(self, values: np.ndarray, track_idxs: np.ndarray) -> np.ndarray:
+        # Mean over finite values for each track, nan for tracks without any
+        finite = np.isfinite(values)
+        sums = np.bincount(track_idxs[finite], weights=values[finite], minlength=self.no_tracks)
+        counts = np.bincount(track_idxs[finite], minlength=self.no_tracks)
+        means = np.full(self.no_tracks, np.nan)
+        np.divide(sums, counts, out=means, where=counts > 0)
+        return means
+
+    def per_track(self) -> List[TrackKinematics]:
+        mean_speed = self._mean_per_track(np.hypot(self.velocities[:,0], self.velocities[:,1]), self.velocity_track_idxs)
+        mean_abs_accel = self._mean_per_track(np.hypot(self.accelerations[:,0], self.accelerations[:,1]), self.turn_track_idxs)
+        mean_abs_heading_change = self._mean_per_track(np.abs(self.heading_changes), self.turn_track_idxs)
+        mean_abs_curvature = self._mean_per_track(np.abs(self.curvatures), self.turn_track_idxs)
+        return [ TrackKinematics(
+            track_id=int(self.track_ids[i]),
+            path_length_center=float(self.path_length_center[i]),
+            mean_speed=float(mean_speed[i]),
+            mean_abs_accel=float(mean_abs_accel[i]),
+            mean_abs_heading_change=float(mean_abs_heading_change[i]),
+            mean_abs_curvature=float(mean_abs_curvature[i])
+            ) for i in range(self.no_tracks) ]
+
+
+def measure_kinematics_packed(packed: PackedTracks) -> Kinematics:
+    centers = packed.centers()
+    track_idxs = packed.track_idxs()
+    step_valid = packed.same_track_as_next()
+
+    # Steps between consecutive points
+    disps = np.diff(centers, axis=0)
+    delta_frames = np.maximum(np.diff(packed.frame_ids), 1).astype(float)
+    step_lengths = np.hypot(disps[:,0], disps[:,1])
+    velocities = disps / delta_frames[:,None]
+    path_length_center = np.bincount(track_idxs[:-1][step_valid], weights=step_lengths[step_valid], minlength=packed.no_tracks)
+
+    # Turns between consecutive steps in the same track
+    turn_valid = step_valid[:-1] & step_valid[1:]
+    accelerations = (velocities[1:] - velocities[:-1]) / (0.5 * (delta_frames[:-1] + delta_frames[1:]))[:,None]
+
+    nonzero = (step_lengths[:-1] > 0) & (step_lengths[1:] > 0)
+    headings = np.arctan2(disps[:,1], disps[:,0])
+    heading_changes = np.angle(np.exp(1j * (headings[1:] - headings[:-1])))
+    heading_changes[~nonzero] = np.nan
+
+    mean_step_lengths = 0.5 * (step_lengths[:-1] + step_lengths[1:])
+    curvatures = np.full(len(heading_changes), np.nan)
+    np.divide(heading_changes, mean_step_lengths, out=curvatures, where=nonzero)
+
+    return Kinematics(
+        track_ids=packed.track_ids,
+        path_length_center=path_length_center,
+        velocities=velocities[step_valid],
+        velocity_track_idxs=track_idxs[:-1][step_valid],
+        accelerations=accelerations[turn_valid],
+        heading_changes=heading_changes[turn_valid],
+        curvatures=curvatures[turn_valid],
+        turn_track_idxs=track_idxs[:-2][turn_valid]
+        )
+
+
+def measure_kinematics(tracks: Tracks) -> Kinematics:
+    return measure_kinematics_packed(PackedTracks.from_tracks(tracks))
+
+
+@dataclass
+class KinematicsStats:
+    feature_to_ave_std: Dict[str,Tuple[float,float]]
+    feature_to_list: Dict[str,List[float]]
+
+    @classmethod
+    def from_dict(cls, feature_to_list: Dict[str,List[float]]):
+        feature_to_ave_std = {}
+        for feature,values in feature_to_list.items():
+            values = [ v for v in values if np.isfinite(v) ]
+            if len(values) == 0:
+                feature_to_ave_std[feature] = (0,0)
+            else:
+                feature_to_ave_std[feature] = (np.mean(values, dtype=float), np.std(values, dtype=float))
+        return cls(feature_to_ave_std, feature_to_list)
+
+
+def measure_kinematics_all_files(file_to_tracks: FileToTracks) -> KinematicsStats:
+    feature_to_list: Dict[str,List[float]] = {}
+    for fname,tracks in tqdm(file_to_tracks.items(), desc="Measuring kinematics for each file"):
+        for track_kin in measure_kinematics(tracks).per_track():
+            for feature,value in track_kin.__dict__.items():
+                if feature == "track_id":
+                    continue
+                feature_to_list.setdefault(feature, []).append(value)
+    return KinematicsStats.from_dict(feature_to_list)
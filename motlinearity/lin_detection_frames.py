@@ -0,0 +1,163 @@
+from motlinearity.data import Tracks
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_triplets import LinTripletChecker
+
+
+from typing import Optional
+from dataclasses import dataclass
+import numpy as np
+import time
+
+
+class FrameLinDetector:
+    # Frame-synchronous linearity detection for all active tracks of a scene
+    # The last boxes of every track are kept in ring buffers of one shared array, indexed by slot; slots are looked up,
+    # allocated and evicted with array operations over all tracks of a frame at once
+    # Tracks not seen for more than max_age frames are evicted and start over when they return (None: never evicted)
+
+
+    def __init__(self, checker: LinTripletChecker, no_dims: int = 4, history: int = 3, max_age: Optional[int] = 30, max_frame_gap: Optional[int] = None, capacity: int = 64):
+        assert history >= 3, f"History must be at least 3 to form triplets, got {history}"
+        self.checker = checker
+        self.no_dims = no_dims
+        self.history = history
+        self.max_age = max_age
+        self.max_frame_gap = max_frame_gap
+
+        self.buffers = np.zeros((capacity, history, no_dims))
+        self.buffer_frame_ids = np.zeros((capacity, history), dtype=np.int64)
+        self.heads = np.zeros(capacity, dtype=np.int64)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.slot_track_ids = np.zeros(capacity, dtype=np.int64)
+        self.occupied = np.zeros(capacity, dtype=bool)
+
+
+    @property
+    def no_active_tracks(self) -> int:
+        return int(np.sum(self.occupied))
+
+
+    def _grow(self, min_capacity: int):
+        capacity = len(self.heads)
+        while capacity < min_capacity:
+            capacity *= 2
+        extra = capacity - len(self.heads)
+        self.buffers = np.concatenate([self.buffers, np.zeros((extra,) + self.buffers.shape[1:])])
+        self.buffer_frame_ids = np.concatenate([self.buffer_frame_ids, np.zeros((extra, self.history), dtype=np.int64)])
+        for name in ["heads", "counts", "last_seen", "slot_track_ids"]:
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(extra, dtype=np.int64)]))
+        self.occupied = np.concatenate([self.occupied, np.zeros(extra, dtype=bool)])
+
+
+    def _evict(self, frame_id: int):
+        # Free the slots of tracks not seen for more than max_age frames
+        if self.max_age is not None:
+            self.occupied &= frame_id - self.last_seen <= self.max_age
+
+
+    def _slots(self, track_ids: np.ndarray) -> np.ndarray:
+        # Slots of known tracks by binary search over the sorted ids of occupied slots, free slots for new tracks
+        occupied_slots = np.nonzero(self.occupied)[0]
+        order = np.argsort(self.slot_track_ids[occupied_slots])
+        sorted_ids = self.slot_track_ids[occupied_slots[order]]
+        pos = np.minimum(np.searchsorted(sorted_ids, track_ids), max(len(sorted_ids) - 1, 0))
+        found = sorted_ids[pos] == track_ids if len(sorted_ids) > 0 else np.zeros(len(track_ids), dtype=bool)
+
+        slots = np.empty(len(track_ids), dtype=np.int64)
+        slots[found] = occupied_slots[order[pos[found]]]
+        no_new = int(np.sum(~found))
+        if no_new > 0:
+            if len(self.heads) - len(occupied_slots) < no_new:
+                self._grow(len(occupied_slots) + no_new)
+            new_slots = np.nonzero(~self.occupied)[0][:no_new]
+            slots[~found] = new_slots
+            self.occupied[new_slots] = True
+            self.slot_track_ids[new_slots] = track_ids[~found]
+            self.counts[new_slots] = 0
+            self.heads[new_slots] = 0
+        return slots
+
+
+    def update(self, frame_id: int, track_ids: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+        # Add the boxes of one frame, shape (n, no_dims), and check the newest triplet of each given track at once
+        # Flag i is True if the previous box of track i is the center of a linear triplet, i.e. it lies on
+        # the line through the box before it and the box given now; tracks with fewer than 3 boxes are not linear
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, self.no_dims)
+        assert len(np.unique(track_ids)) == len(track_ids), f"Track ids in frame {frame_id} are not unique"
+
+        self._evict(frame_id)
+        slots = self._slots(track_ids)
+
+        # Tracks that skipped too many frames start over
+        if self.max_frame_gap is not None:
+            last = self.buffer_frame_ids[slots, (self.heads[slots] - 1) % self.history]
+            self.counts[slots[(self.counts[slots] > 0) & (frame_id - last > self.max_frame_gap)]] = 0
+
+        heads = self.heads[slots]
+        self.buffers[slots, heads] = boxes
+        self.buffer_frame_ids[slots, heads] = frame_id
+        self.heads[slots] = (heads + 1) % self.history
+        self.counts[slots] = np.minimum(self.counts[slots] + 1, self.history)
+        self.last_seen[slots] = frame_id
+
+        # Last three boxes of every given track
+        xyxy1s = self.buffers[slots, (heads - 2) % self.history]
+        xyxy2s = self.buffers[slots, (heads - 1) % self.history]
+        xyxy3s = boxes
+        if self.no_dims == 4:
+            is_linear = self.checker.check_xyxy_triplets_in_line(xyxy1s, xyxy2s, xyxy3s)
+        else:
+            is_linear = self.checker.check_triplets_in_line(xyxy1s, xyxy2s, xyxy3s)
+        return is_linear & (self.counts[slots] >= 3)
+
+
+@dataclass
+class FrameReplay:
+    no_frames: int
+    no_boxes: int
+    duration_sec: float
+    frames_per_sec: float
+
+    # Mask over the points of the packed tracks of the centers of linear triplets, as flagged frame by frame
+    is_center_linear: np.ndarray
+
+
+def replay_packed_by_frame(packed: PackedTracks, checker: LinTripletChecker, max_age: Optional[int] = None, max_frame_gap: Optional[int] = None) -> FrameReplay:
+    # Feed a sequence frame by frame to a FrameLinDetector; only the update loop is timed
+    # Without max_age and max_frame_gap the mask is the same as find_linear_centers_packed; with them, tracks that
+    # are evicted or skip frames start over, and their first triplets after the restart are not linear
+    order = np.argsort(packed.frame_ids, kind="stable")
+    frame_ids_sorted = packed.frame_ids[order]
+    frame_starts = np.nonzero(np.diff(frame_ids_sorted, prepend=frame_ids_sorted[:1] - 1))[0]
+    frame_ends = np.append(frame_starts[1:], len(order))
+
+    # Previous point of the same track, which is the center the flag of each point refers to
+    point_track_ids = packed.track_ids[packed.track_idxs()]
+    prev_idxs = np.arange(packed.no_points) - 1
+    is_first = np.ones(packed.no_points, dtype=bool)
+    is_first[1:] = ~packed.same_track_as_next()
+
+    detector = FrameLinDetector(checker, no_dims=packed.data.shape[1], max_age=max_age, max_frame_gap=max_frame_gap)
+    is_center_linear = np.zeros(packed.no_points, dtype=bool)
+    start = time.perf_counter()
+    for frame_start,frame_end in zip(frame_starts, frame_ends):
+        idxs = order[frame_start:frame_end]
+        flags = detector.update(int(frame_ids_sorted[frame_start]), point_track_ids[idxs], packed.data[idxs])
+        flagged = idxs[flags & ~is_first[idxs]]
+        is_center_linear[prev_idxs[flagged]] = True
+    duration_sec = time.perf_counter() - start
+    is_center_linear &= packed.observed()
+
+    return FrameReplay(
+        no_frames=len(frame_starts),
+        no_boxes=packed.no_points,
+        duration_sec=duration_sec,
+        frames_per_sec=len(frame_starts) / duration_sec if duration_sec > 0 else np.inf,
+        is_center_linear=is_center_linear
+        )
+
+
+def replay_by_frame(tracks: Tracks, checker: LinTripletChecker, max_age: Optional[int] = None, max_frame_gap: Optional[int] = None) -> FrameReplay:
+    return replay_packed_by_frame(PackedTracks.from_tracks(tracks), checker, max_age, max_frame_gap)
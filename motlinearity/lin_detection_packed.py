@@ -0,0 +1,58 @@
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_triplets import LinTripletChecker
+
+
+from typing import Optional, Tuple
+import numpy as np
+
+
+def center_mask_to_segment_bounds(is_center_linear: np.ndarray, is_interpolated: Optional[np.ndarray] = None) -> Tuple[np.ndarray,np.ndarray]:
+    # Inclusive start and end point idxs of the segments of a mask over the centers of linear triplets: runs of linear
+    # centers plus the point on either side. Runs never cross tracks of packed tracks since the ends of a track are never centers
+    # With interpolated points, which are never centers, runs separated only by interpolated points are joined and the
+    # ends are moved out to the nearest observed points. Interpolated points lie on the line between their observed
+    # neighbours, so segments then cover the same observed points as without resampling for the slope and angle modes
+    is_center_linear = np.asarray(is_center_linear, dtype=bool)
+    if is_interpolated is None or not np.any(is_interpolated):
+        edges = np.diff(np.concatenate([[0], is_center_linear.astype(np.int8), [0]]))
+        return np.nonzero(edges == 1)[0] - 1, np.nonzero(edges == -1)[0]
+
+    # Nearest observed point at or before and at or after every point; the ends of tracks are observed
+    is_interpolated = np.asarray(is_interpolated, dtype=bool)
+    idxs = np.arange(len(is_center_linear))
+    prev_observed = np.maximum.accumulate(np.where(is_interpolated, 0, idxs))
+    next_observed = np.minimum.accumulate(np.where(is_interpolated, len(idxs) - 1, idxs)[::-1])[::-1]
+    bridged = is_center_linear | (is_interpolated & is_center_linear[prev_observed] & is_center_linear[next_observed])
+
+    starts, ends = center_mask_to_segment_bounds(bridged)
+    return prev_observed[starts], next_observed[ends]
+
+
+def no_observed_points_in_segments(packed: PackedTracks, seg_starts: np.ndarray, seg_ends: np.ndarray) -> np.ndarray:
+    no_observed_before = np.concatenate([[0], np.cumsum(packed.observed())])
+    return no_observed_before[seg_ends + 1] - no_observed_before[seg_starts]
+
+
+def segment_bounds_to_mask(seg_starts: np.ndarray, seg_ends: np.ndarray, no_points: int) -> np.ndarray:
+    # Mask over points in any segment, by a running count of segments opened and closed
+    counts = np.zeros(no_points + 1, dtype=np.int64)
+    np.add.at(counts, seg_starts, 1)
+    np.add.at(counts, seg_ends + 1, -1)
+    return np.cumsum(counts[:-1]) > 0
+
+
+def find_linear_centers_packed(packed: PackedTracks, checker: LinTripletChecker) -> np.ndarray:
+    # Mask over all points of all tracks of the centers of linear triplets, checked in one pass
+    is_center_linear = np.zeros(packed.no_points, dtype=bool)
+    if packed.no_points < 3:
+        return is_center_linear
+
+    same_track = packed.same_track_as_next()
+    triplets_valid = same_track[:-1] & same_track[1:]
+    data = packed.data
+    if packed.is_xyxy:
+        is_linear = checker.check_xyxy_triplets_in_line(data[:-2], data[1:-1], data[2:])
+    else:
+        is_linear = checker.check_triplets_in_line(data[:-2], data[1:-1], data[2:])
+    is_center_linear[1:-1] = is_linear & triplets_valid
+    return is_center_linear & packed.observed()
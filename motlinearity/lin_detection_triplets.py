@@ -1,6 +1,6 @@
 import plotly.graph_objects as go
 from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from loguru import logger
 import numpy as np
 from mashumaro import DataClassDictMixin
@@ -33,14 +33,40 @@ class LinTripletChecker:
         
 
         class Mode(Enum):
+            # PERTURB: slope ranges of the two steps overlap when each point is moved by up to perturb_mag
+            # TOL: |m12 - m23| <= tol for the slopes m = delta y / delta x of the two steps
+            # TOL_CROSS: same test as TOL written as |cross(d12, d23)| <= tol |delta x12 delta x23|, without division
+            # ANGLE: |sin| of the angle between the steps <= tol, i.e. |cross(d12, d23)| <= tol |d12| |d23|
+            # All modes treat a repeated point as not linear and, like slopes, do not distinguish reversing direction
             PERTURB = "perturb"
             TOL = "tol"
+            TOL_CROSS = "tol-cross"
+            ANGLE = "angle"
+
+
+        class XyxyPoint(Enum):
+            TOP_LEFT = "top-left"
+            BOTTOM_RIGHT = "bottom-right"
+            CENTER = "center"
+            SIZE = "size"
+
+
+        class Combine(Enum):
+            ALL = "all"
+            ANY = "any"
 
 
         mode: Mode = Mode.PERTURB
         perturb_mag: float = 1.0
         tol: float = 0.1
 
+        # Points of each box checked for xyxy tracks, and how the per-point results are combined
+        xyxy_points: List[XyxyPoint] = field(default_factory=lambda: [
+            LinTripletChecker.Options.XyxyPoint.TOP_LEFT,
+            LinTripletChecker.Options.XyxyPoint.BOTTOM_RIGHT
+            ])
+        xyxy_combine: Combine = Combine.ALL
+
 
     def __init__(self, options: Options):
         self.options = options
@@ -51,6 +77,8 @@ class LinTripletChecker:
             return self._check_if_triplet_in_line_perturb(xy1, xy2, xy3)
         elif self.options.mode == self.Options.Mode.TOL:
             return self._check_if_triplet_in_line_tol(xy1, xy2, xy3)
+        elif self.options.mode in [self.Options.Mode.TOL_CROSS, self.Options.Mode.ANGLE]:
+            return LinTriplet(bool(self._check_triplets_in_line_cross(np.asarray(xy1, dtype=float), np.asarray(xy2, dtype=float), np.asarray(xy3, dtype=float))))
         else:
             raise NotADirectoryError(f"Unknown mode {self.options.mode}")
 
@@ -131,34 +159,218 @@ class LinTripletChecker:
         return idx_linear
 
 
-    def find_linear_triplets_xyxy(self, xyxys: List[List[float]]) -> List[int]:
+    def check_triplets_in_line(self, xy1s: np.ndarray, xy2s: np.ndarray, xy3s: np.ndarray) -> np.ndarray:
+        # Vectorized version of check_if_triplet_in_line over arrays of shape (...,2)
+        # Returns a boolean mask of shape (...) with the same semantics as the scalar checks
+        xy1s = np.asarray(xy1s, dtype=float)
+        xy2s = np.asarray(xy2s, dtype=float)
+        xy3s = np.asarray(xy3s, dtype=float)
+        if self.options.mode == self.Options.Mode.PERTURB:
+            return self._check_triplets_in_line_perturb(xy1s, xy2s, xy3s)
+        elif self.options.mode == self.Options.Mode.TOL:
+            return self._check_triplets_in_line_tol(xy1s, xy2s, xy3s)
+        elif self.options.mode in [self.Options.Mode.TOL_CROSS, self.Options.Mode.ANGLE]:
+            return self._check_triplets_in_line_cross(xy1s, xy2s, xy3s)
+        else:
+            raise NotImplementedError(f"Unknown mode {self.options.mode}")
 
-        idx_linear = []
-        for i in range(1,len(xyxys)-1):
-            xyxy1 = xyxys[i-1]
-            xyxy2 = xyxys[i]
-            xyxy3 = xyxys[i+1]
 
-            # Check if in a line
-            xy_bl_1 = [xyxy1[0], xyxy1[1]]
-            xy_bl_2 = [xyxy2[0], xyxy2[1]]
-            xy_bl_3 = [xyxy3[0], xyxy3[1]]
-            t_bl = self.check_if_triplet_in_line(xy_bl_1, xy_bl_2, xy_bl_3)
+    def _check_triplets_in_line_perturb(self, xy1s: np.ndarray, xy2s: np.ndarray, xy3s: np.ndarray) -> np.ndarray:
+        d12 = xy2s - xy1s
+        d23 = xy3s - xy2s
+        same_pt = np.all(d12 == 0, axis=-1) | np.all(d23 == 0, axis=-1)
 
-            xy_tr_1 = [xyxy1[2], xyxy1[3]]
-            xy_tr_2 = [xyxy2[2], xyxy2[3]]
-            xy_tr_3 = [xyxy3[2], xyxy3[3]]
-            t_tr = self.check_if_triplet_in_line(xy_tr_1, xy_tr_2, xy_tr_3)
+        delta_x12, delta_y12 = d12[...,0], d12[...,1]
+        delta_x23, delta_y23 = d23[...,0], d23[...,1]
+        zero_x = (delta_x12 == 0) | (delta_x23 == 0)
+        zero_x_linear = (delta_x12 == 0) & (delta_x23 == 0)
 
-            # logger.debug(f"Slopes: {t_bl.m12} {t_bl.m23} {t_bl.is_linear} {t_tr.m12} {t_tr.m23} {t_tr.is_linear}")
+        # Slopes are set to 0 where the denominator vanishes, as in the scalar check
+        p = self.options.perturb_mag
+        def _slope(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+            return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den != 0)
+        m12_min = _slope(delta_y12 - 2*p, delta_x12 + 2*p)
+        m12_max = _slope(delta_y12 + 2*p, delta_x12 - 2*p)
+        m23_min = _slope(delta_y23 - 2*p, delta_x23 + 2*p)
+        m23_max = _slope(delta_y23 + 2*p, delta_x23 - 2*p)
+
+        is_linear = ((m12_min <= m23_max) & (m12_max >= m23_min)) | ((m23_min <= m12_max) & (m23_max >= m12_min))
+        return ~same_pt & np.where(zero_x, zero_x_linear, is_linear)
+
+
+    def _check_triplets_in_line_cross(self, xy1s: np.ndarray, xy2s: np.ndarray, xy3s: np.ndarray) -> np.ndarray:
+        # Branch-free: no division, vertical steps need no special case
+        # TOL_CROSS gives the same results as TOL up to rounding: |m12 - m23| = |cross| / |delta x12 delta x23|,
+        # and with a vertical step the bound is 0, so only two vertical steps are linear, as in TOL
+        d12 = xy2s - xy1s
+        d23 = xy3s - xy2s
+        cross = d12[...,0] * d23[...,1] - d12[...,1] * d23[...,0]
+        len_sq12 = d12[...,0]**2 + d12[...,1]**2
+        len_sq23 = d23[...,0]**2 + d23[...,1]**2
+
+        if self.options.mode == self.Options.Mode.TOL_CROSS:
+            bound = self.options.tol * np.abs(d12[...,0] * d23[...,0])
+        else:
+            bound = self.options.tol * np.sqrt(len_sq12 * len_sq23)
+        return (len_sq12 > 0) & (len_sq23 > 0) & (np.abs(cross) <= bound)
+
+
+    def triplet_scores_tol(self, xy1s: np.ndarray, xy2s: np.ndarray, xy3s: np.ndarray) -> np.ndarray:
+        # Slope difference |m12 - m23| of each triplet, such that the TOL check is score <= tol
+        # Two vertical steps score 0, a single vertical step or a repeated point scores inf
+        xy1s = np.asarray(xy1s, dtype=float)
+        xy2s = np.asarray(xy2s, dtype=float)
+        xy3s = np.asarray(xy3s, dtype=float)
+        d12 = xy2s - xy1s
+        d23 = xy3s - xy2s
+        same_pt = np.all(d12 == 0, axis=-1) | np.all(d23 == 0, axis=-1)
+
+        delta_x12, delta_y12 = d12[...,0], d12[...,1]
+        delta_x23, delta_y23 = d23[...,0], d23[...,1]
+        zero_x = (delta_x12 == 0) | (delta_x23 == 0)
+        zero_x_linear = (delta_x12 == 0) & (delta_x23 == 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            m12 = delta_y12 / delta_x12
+            m23 = delta_y23 / delta_x23
+            scores = np.abs(m12 - m23)
+        scores = np.where(zero_x, np.where(zero_x_linear, 0.0, np.inf), scores)
+        return np.where(same_pt, np.inf, scores)
+
+
+    def triplet_scores(self, xy1s: np.ndarray, xy2s: np.ndarray, xy3s: np.ndarray) -> np.ndarray:
+        # Score of each triplet for the configured mode, such that the check is score <= tol
+        # TOL and TOL_CROSS: slope difference |cross| / |delta x12 delta x23|; ANGLE: |sin| = |cross| / (|d12| |d23|)
+        # A repeated point scores inf; PERTURB has no tolerance and no score
+        if self.options.mode == self.Options.Mode.TOL:
+            return self.triplet_scores_tol(xy1s, xy2s, xy3s)
+        if self.options.mode not in [self.Options.Mode.TOL_CROSS, self.Options.Mode.ANGLE]:
+            raise ValueError(f"Mode {self.options.mode} has no triplet scores - use TOL, TOL_CROSS or ANGLE")
+        d12 = np.asarray(xy2s, dtype=float) - np.asarray(xy1s, dtype=float)
+        d23 = np.asarray(xy3s, dtype=float) - np.asarray(xy2s, dtype=float)
+        cross = np.abs(d12[...,0] * d23[...,1] - d12[...,1] * d23[...,0])
+        len_sq12 = d12[...,0]**2 + d12[...,1]**2
+        len_sq23 = d23[...,0]**2 + d23[...,1]**2
+        if self.options.mode == self.Options.Mode.TOL_CROSS:
+            denom = np.abs(d12[...,0] * d23[...,0])
+        else:
+            denom = np.sqrt(len_sq12 * len_sq23)
 
-            if not t_tr.is_linear or not t_bl.is_linear:
-                continue
-            
-            # In a line
-            idx_linear.append(i)
+        # Along a vertical step only collinear triplets pass, with any tol
+        scores = np.divide(cross, denom, out=np.where(cross == 0, 0.0, np.inf), where=denom > 0)
+        return np.where((len_sq12 > 0) & (len_sq23 > 0), scores, np.inf)
 
-        return idx_linear
+
+    def _check_triplets_in_line_tol(self, xy1s: np.ndarray, xy2s: np.ndarray, xy3s: np.ndarray) -> np.ndarray:
+        return self.triplet_scores_tol(xy1s, xy2s, xy3s) <= self.options.tol
+
+
+    def _xyxy_point(self, xyxys: np.ndarray, point: Options.XyxyPoint) -> np.ndarray:
+        if point == self.Options.XyxyPoint.TOP_LEFT:
+            return xyxys[...,:2]
+        elif point == self.Options.XyxyPoint.BOTTOM_RIGHT:
+            return xyxys[...,2:]
+        elif point == self.Options.XyxyPoint.CENTER:
+            return 0.5 * (xyxys[...,:2] + xyxys[...,2:])
+        elif point == self.Options.XyxyPoint.SIZE:
+            return xyxys[...,2:] - xyxys[...,:2]
+        else:
+            raise NotImplementedError(f"Unknown xyxy point {point}")
+
+
+    def check_xyxy_triplets_in_line(self, xyxy1s: np.ndarray, xyxy2s: np.ndarray, xyxy3s: np.ndarray, short_circuit: bool = True) -> np.ndarray:
+        # Fused check of all configured box points over arrays of shape (...,4)
+        # With short_circuit, later points are only evaluated for triplets whose outcome is still undecided,
+        # else every point is evaluated densely over the whole array
+        xyxy1s, xyxy2s, xyxy3s = np.broadcast_arrays(*[ np.asarray(x, dtype=float) for x in (xyxy1s, xyxy2s, xyxy3s) ])
+
+        combine_all = self.options.xyxy_combine == self.Options.Combine.ALL
+        if not combine_all and self.options.xyxy_combine != self.Options.Combine.ANY:
+            raise NotImplementedError(f"Unknown combine rule {self.options.xyxy_combine}")
+
+        if not short_circuit:
+            is_linear = [ self.check_triplets_in_line(
+                self._xyxy_point(xyxy1s, point),
+                self._xyxy_point(xyxy2s, point),
+                self._xyxy_point(xyxy3s, point)
+                ) for point in self.options.xyxy_points ]
+            if combine_all:
+                return np.logical_and.reduce(is_linear, axis=0) if len(is_linear) > 0 else np.ones(xyxy1s.shape[:-1], dtype=bool)
+            return np.logical_or.reduce(is_linear, axis=0) if len(is_linear) > 0 else np.zeros(xyxy1s.shape[:-1], dtype=bool)
+
+        shape = xyxy1s.shape[:-1]
+        xyxy1s = xyxy1s.reshape(-1,4)
+        xyxy2s = xyxy2s.reshape(-1,4)
+        xyxy3s = xyxy3s.reshape(-1,4)
+
+        is_linear = np.full(len(xyxy1s), combine_all)
+        undecided = np.arange(len(xyxy1s))
+        for point in self.options.xyxy_points:
+            if len(undecided) == 0:
+                break
+            t = self.check_triplets_in_line(
+                self._xyxy_point(xyxy1s[undecided], point),
+                self._xyxy_point(xyxy2s[undecided], point),
+                self._xyxy_point(xyxy3s[undecided], point)
+                )
+            if combine_all:
+                is_linear[undecided[~t]] = False
+                undecided = undecided[t]
+            else:
+                is_linear[undecided[t]] = True
+                undecided = undecided[~t]
+
+        return is_linear.reshape(shape)
+
+
+    def _combine_xyxy_scores(self, score_fn, xyxy1s: np.ndarray, xyxy2s: np.ndarray, xyxy3s: np.ndarray) -> np.ndarray:
+        xyxy1s = np.asarray(xyxy1s, dtype=float)
+        xyxy2s = np.asarray(xyxy2s, dtype=float)
+        xyxy3s = np.asarray(xyxy3s, dtype=float)
+        scores = np.stack([ score_fn(
+            self._xyxy_point(xyxy1s, point),
+            self._xyxy_point(xyxy2s, point),
+            self._xyxy_point(xyxy3s, point)
+            ) for point in self.options.xyxy_points ])
+        if self.options.xyxy_combine == self.Options.Combine.ALL:
+            return np.max(scores, axis=0)
+        elif self.options.xyxy_combine == self.Options.Combine.ANY:
+            return np.min(scores, axis=0)
+        else:
+            raise NotImplementedError(f"Unknown combine rule {self.options.xyxy_combine}")
+
+
+    def xyxy_triplet_scores_tol(self, xyxy1s: np.ndarray, xyxy2s: np.ndarray, xyxy3s: np.ndarray) -> np.ndarray:
+        # Scores of all configured box points combined, such that the TOL check of the box is score <= tol
+        return self._combine_xyxy_scores(self.triplet_scores_tol, xyxy1s, xyxy2s, xyxy3s)
+
+
+    def xyxy_triplet_scores(self, xyxy1s: np.ndarray, xyxy2s: np.ndarray, xyxy3s: np.ndarray) -> np.ndarray:
+        # Same for the configured mode, see triplet_scores
+        return self._combine_xyxy_scores(self.triplet_scores, xyxy1s, xyxy2s, xyxy3s)
+
+
+    def find_linear_triplets_xyxy(self, xyxys: List[List[float]]) -> List[int]:
+        xyxys = np.asarray(xyxys, dtype=float).reshape(-1,4)
+        if len(xyxys) < 3:
+            return []
+        is_linear = self.check_xyxy_triplets_in_line(xyxys[:-2], xyxys[1:-1], xyxys[2:])
+        return (np.nonzero(is_linear)[0] + 1).tolist()
+
+    def lin_centers_to_points_in_segments(self, is_center_linear: np.ndarray) -> np.ndarray:
+        # A point is in a linear segment if it is the center or an end of a linear triplet
+        # Mask over points along the first axis; the first and last points can not be centers
+        in_segments = is_center_linear.copy()
+        in_segments[1:] |= is_center_linear[:-1]
+        in_segments[:-1] |= is_center_linear[1:]
+        return in_segments
+
+    def lin_center_mask_to_segments(self, is_center_linear: np.ndarray, is_interpolated: Optional[np.ndarray] = None) -> List[LinSeg]:
+        # Same segments as lin_idxs_to_segments, from a mask over points of the centers of linear triplets
+        # With is_interpolated, segments are joined across interpolated points, see center_mask_to_segment_bounds
+        from motlinearity.lin_detection_packed import center_mask_to_segment_bounds
+        starts, ends = center_mask_to_segment_bounds(is_center_linear, is_interpolated)
+        return [ LinSeg(int(start), int(end)) for start,end in zip(starts,ends) ]
 
     def lin_idxs_to_segments(self, idxs: List[int]) -> List[LinSeg]:
         if len(idxs) == 0:
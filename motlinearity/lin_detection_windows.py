@@ -0,0 +1,153 @@
+from motlinearity.data import Tracks
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_triplets import LinTripletChecker, LinSeg
+from motlinearity.data_lin import LinSegs
+from motlinearity.lin_detection_packed import center_mask_to_segment_bounds
+
+
+from typing import Dict
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+@dataclass
+class TrackWindows:
+    # Tracks tiled into fixed length windows, padded at the end of each track
+    # Consecutive windows of a track overlap by 2 points, so every triplet center is in the interior of exactly one window
+    data: np.ndarray
+    valid: np.ndarray
+
+    # Valid points measured in the data, not filled in by resampling
+    observed: np.ndarray
+    track_idxs: np.ndarray
+    start_idxs: np.ndarray
+    packed: PackedTracks
+
+    @property
+    def no_windows(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def window_size(self) -> int:
+        return self.data.shape[1]
+
+    @classmethod
+    def from_packed(cls, packed: PackedTracks, window_size: int):
+        assert window_size >= 3, f"Window size must be at least 3, got {window_size}"
+        stride = window_size - 2
+        lengths = packed.lengths
+        no_windows_per_track = np.maximum(1, -(-np.maximum(lengths - 2, 0) // stride))
+
+        track_idxs = np.repeat(np.arange(packed.no_tracks), no_windows_per_track)
+        first_window = np.repeat(np.cumsum(no_windows_per_track) - no_windows_per_track, no_windows_per_track)
+        start_idxs = (np.arange(len(track_idxs)) - first_window) * stride
+
+        # Index within the track of every point of every window
+        idxs = start_idxs[:,None] + np.arange(window_size)[None,:]
+        valid = idxs < lengths[track_idxs][:,None]
+        # Padding gathers a point in range, also for empty tracks at the end of the packed arrays; without any points
+        # a single padding point is gathered
+        gather = np.minimum(packed.offsets[track_idxs][:,None] + np.where(valid, idxs, 0), max(packed.no_points - 1, 0))
+        points = packed.data if packed.no_points > 0 else np.zeros((1, packed.data.shape[1]))
+        observed = packed.observed() if packed.no_points > 0 else np.zeros(1, dtype=bool)
+        data = np.where(valid[:,:,None], points[gather], 0.0)
+        return cls(
+            data=np.ascontiguousarray(data),
+            valid=valid,
+            observed=valid & observed[gather],
+            track_idxs=track_idxs,
+            start_idxs=start_idxs,
+            packed=packed
+            )
+
+
+@dataclass
+class WindowStats:
+    no_valid_points: np.ndarray
+    no_lin_segments: np.ndarray
+    no_points_in_lin_segments: np.ndarray
+
+
+def _check_windows(data: np.ndarray, valid: np.ndarray, checker: LinTripletChecker) -> np.ndarray:
+    triplets_valid = valid[:,:-2] & valid[:,1:-1] & valid[:,2:]
+    if data.shape[2] == 4:
+        is_linear = checker.check_xyxy_triplets_in_line(data[:,:-2], data[:,1:-1], data[:,2:], short_circuit=False)
+    else:
+        is_linear = checker.check_triplets_in_line(data[:,:-2], data[:,1:-1], data[:,2:])
+
+    is_center_linear = np.zeros(valid.shape, dtype=bool)
+    is_center_linear[:,1:-1] = is_linear & triplets_valid
+    return is_center_linear
+
+
+def find_linear_triplets_windows(windows: TrackWindows, checker: LinTripletChecker, no_threads: int = 1) -> np.ndarray:
+    # Mask of shape (no windows, window size) of the centers of linear triplets
+    # With no_threads > 1 the windows are split into chunks checked concurrently, numpy releases the GIL on the large ops
+    # Interpolated points are never centers
+    if no_threads <= 1 or windows.no_windows < 2 * no_threads:
+        return _check_windows(windows.data, windows.valid, checker) & windows.observed
+
+    chunks = np.array_split(np.arange(windows.no_windows), no_threads)
+    with ThreadPoolExecutor(max_workers=no_threads) as executor:
+        results = executor.map(lambda chunk: _check_windows(windows.data[chunk[0]:chunk[-1]+1], windows.valid[chunk[0]:chunk[-1]+1], checker), chunks)
+        return np.concatenate(list(results), axis=0) & windows.observed
+
+
+def window_stats(windows: TrackWindows, is_center_linear: np.ndarray, checker: LinTripletChecker) -> WindowStats:
+    # Segments here are runs of linear centers within a window, cut at the window edges
+    # Only observed points are counted
+    in_segments = checker.lin_centers_to_points_in_segments(is_center_linear.T).T & windows.observed
+    no_lin_segments = np.count_nonzero(np.diff(is_center_linear.astype(np.int8), axis=1, prepend=0) == 1, axis=1)
+    return WindowStats(
+        no_valid_points=np.count_nonzero(windows.observed, axis=1),
+        no_lin_segments=no_lin_segments,
+        no_points_in_lin_segments=np.count_nonzero(in_segments, axis=1)
+        )
+
+
+def find_linear_segments_windows(windows: TrackWindows, is_center_linear: np.ndarray, checker: LinTripletChecker, exact: bool = True) -> Dict[int,LinSegs]:
+    # With exact, window results are stitched back into whole tracks and the segments are identical to find_linear_segments
+    # Else segments are found per window and cut where they cross from one window into the next
+    packed = windows.packed
+
+    if exact:
+        # Window interiors partition the triplet centers of each track
+        interior = np.zeros(is_center_linear.shape, dtype=bool)
+        interior[:,1:-1] = True
+        w, j = np.nonzero(is_center_linear & interior)
+        is_center_linear_packed = np.zeros(packed.no_points, dtype=bool)
+        is_center_linear_packed[packed.offsets[windows.track_idxs[w]] + windows.start_idxs[w] + j] = True
+
+        # First and last points of a track are never centers, so segments can not run across tracks
+        seg_starts, seg_ends = center_mask_to_segment_bounds(is_center_linear_packed, packed.is_interpolated)
+        seg_track_idxs = np.searchsorted(packed.offsets, seg_starts, side="right") - 1
+        seg_starts = seg_starts - packed.offsets[seg_track_idxs]
+        seg_ends = seg_ends - packed.offsets[seg_track_idxs]
+    else:
+        # First and last points of a window are never centers, so segments of the flattened windows can not run across windows
+        seg_starts, seg_ends = center_mask_to_segment_bounds(is_center_linear.ravel())
+        w = seg_starts // windows.window_size
+        seg_track_idxs = windows.track_idxs[w]
+        seg_starts = seg_starts - w * windows.window_size + windows.start_idxs[w]
+        seg_ends = seg_ends - w * windows.window_size + windows.start_idxs[w]
+
+    # Segments are sorted by track
+    track_bounds = np.searchsorted(seg_track_idxs, np.arange(packed.no_tracks + 1))
+    track_to_segs = {}
+    for i in range(packed.no_tracks):
+        track_id = int(packed.track_ids[i])
+        track_to_segs[track_id] = LinSegs(
+            [ LinSeg(int(start), int(end)) for start,end in zip(seg_starts[track_bounds[i]:track_bounds[i+1]], seg_ends[track_bounds[i]:track_bounds[i+1]]) ],
+            no_points_in_track=int(packed.lengths[i]),
+            track_id=track_id,
+            frame_ids=packed.frame_ids[packed.track_slice(i)].tolist(),
+            is_interpolated=packed.is_interpolated[packed.track_slice(i)].tolist() if packed.is_interpolated is not None else None
+            )
+    return track_to_segs
+
+
+def find_linear_segments_windowed(tracks: Tracks, checker: LinTripletChecker, window_size: int = 64, exact: bool = True, no_threads: int = 1) -> Dict[int,LinSegs]:
+    windows = TrackWindows.from_packed(PackedTracks.from_tracks(tracks), window_size)
+    is_center_linear = find_linear_triplets_windows(windows, checker, no_threads)
+    return find_linear_segments_windows(windows, is_center_linear, checker, exact)
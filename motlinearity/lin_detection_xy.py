@@ -4,14 +4,22 @@ from motlinearity.data_lin import LinSegs
 
 
 from typing import List
+import numpy as np
 
 
 def find_linear_triplets(track: TrackXy, checker: LinTripletChecker) -> List[int]:
     xys = [ [ float(z) for z in entry.data ] for entry in track.entries]
-    return checker.find_linear_triplets(xys)
+    # Interpolated points are never centers of linear triplets
+    return [ idx for idx in checker.find_linear_triplets(xys) if not track.entries[idx].is_interpolated ]
 
 
 def find_linear_segments(track: TrackXy, checker: LinTripletChecker) -> LinSegs:
     idxs = find_linear_triplets(track, checker)
-    segments = checker.lin_idxs_to_segments(idxs)
-    return LinSegs(segments, no_points_in_track=len(track.entries), track_id=track.track_id)
\ No newline at end of file
+    is_interpolated = [ entry.is_interpolated for entry in track.entries ]
+    if any(is_interpolated):
+        is_center_linear = np.zeros(len(track.entries), dtype=bool)
+        is_center_linear[idxs] = True
+        segments = checker.lin_center_mask_to_segments(is_center_linear, np.array(is_interpolated))
+    else:
+        segments = checker.lin_idxs_to_segments(idxs)
+    return LinSegs(segments, no_points_in_track=len(track.entries), track_id=track.track_id, frame_ids=[ entry.frame_id for entry in track.entries ], is_interpolated=is_interpolated)
\ No newline at end of file
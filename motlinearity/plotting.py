@@ -3,6 +3,7 @@ from motlinearity.data_lin import LinSegs
 
 from typing import List, Dict, Optional, Union, Tuple
 import plotly.graph_objects as go
+import numpy as np
 
 
 class PlotterTrajs:
@@ -149,6 +150,15 @@ class PlotterHist:
         self.fig.add_trace(trace, row=row, col=col)
 
 
+    def add_hist_counts(self, bins: np.ndarray, counts: np.ndarray, row: Optional[int] = None, col: Optional[int] = None):
+        # Same plot as add_hist from pre-binned counts (e.g. an IntHistogram), so the figure does not hold every value
+        total = np.sum(counts)
+        percent = 100 * np.asarray(counts, dtype=float) / total if total > 0 else np.zeros(len(counts))
+        trace = go.Bar(x=bins, y=percent, width=1, showlegend=False)
+        self.fig.add_trace(trace, row=row, col=col)
+        self.fig.update_layout(bargap=0)
+
+
 class PlotterFrac:
 
 
@@ -1,22 +1,164 @@
 from motlinearity.data import DispProb, TracksXy, TrackXy, Entry
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_packed import center_mask_to_segment_bounds
 
 
 import numpy as np
-from typing import List
+from enum import Enum
+from typing import List, Optional
+from dataclasses import dataclass
+from mashumaro import DataClassDictMixin
 
 
-def sample_random_walk(no_trajs: int, no_pts_per_traj: int, disps_probs: List[DispProb]) -> TracksXy:
+def sample_random_walk(no_trajs: int, no_pts_per_traj: int, disps_probs: List[DispProb], seed: Optional[int] = None) -> TracksXy:
+    # Random walks of i.i.d. integer displacements drawn from the empirical displacement distribution, starting at the origin
+    rng = np.random.default_rng(seed)
+    disps = np.array([ [dp.disp_x, dp.disp_y] for dp in disps_probs ], dtype=np.int64)
+    probs = np.array([ dp.prob for dp in disps_probs ], dtype=float)
+    idxs = rng.choice(len(disps_probs), size=(no_trajs, max(no_pts_per_traj-1, 0)), p=probs / probs.sum())
+    points = np.zeros((no_trajs, no_pts_per_traj, 2), dtype=np.int64)
+    np.cumsum(disps[idxs], axis=1, out=points[:,1:])
+
     tracks = TracksXy({})
     for track_id in range(0,no_trajs):
-
-        entries: List[Entry] = [ Entry(data=[0,0], frame_id=0, track_id=track_id) ]
+        entries = [ Entry(data=xy, frame_id=j, track_id=track_id) for j,xy in enumerate(points[track_id].tolist()) ]
         tracks.tracks[track_id] = TrackXy(track_id=track_id, entries=entries)
-        for j in range(1,no_pts_per_traj):
-            # Sample displacement
-            track_id = np.random.choice(list(range(len(disps_probs))), p=[ dp.prob for dp in disps_probs ])
-            disp_x = disps_probs[track_id].disp_x
-            disp_y = disps_probs[track_id].disp_y
-            
-            # Add to points
-            entries.append(Entry(frame_id=j, track_id=track_id, data=[entries[-1].data[0]+int(disp_x), entries[-1].data[1]+int(disp_y)]))
     return tracks
+
+
+@dataclass
+class RandomWalkOptions(DataClassDictMixin):
+
+
+    class MotionModel(Enum):
+        # EMPIRICAL: i.i.d. integer displacements from the empirical displacement distribution (needs disps_probs)
+        # CONSTANT_VELOCITY: one velocity per track, the whole track is a ground truth linear segment
+        # CORRELATED: AR(1) velocities v[t] = mu + ar_coeff (v[t-1] - mu) + eps around a per-track mean velocity mu
+        # PIECEWISE_LINEAR: constant velocity pieces of random length, which are the ground truth linear segments;
+        #   a fraction random_piece_frac of the pieces instead jitter the velocity every step and are not linear
+        EMPIRICAL = "empirical"
+        CONSTANT_VELOCITY = "constant-velocity"
+        CORRELATED = "correlated"
+        PIECEWISE_LINEAR = "piecewise-linear"
+
+
+    motion_model: MotionModel = MotionModel.PIECEWISE_LINEAR
+
+    # Speed (pixels per frame) of the velocity of each track or piece, in a uniformly random direction
+    speed_mean: float = 3.0
+    speed_std: float = 1.0
+
+    # Std of the Gaussian localization noise added to every point
+    noise_std: float = 0.0
+
+    # CORRELATED: correlation of consecutive velocities; the velocity std around the mean is speed_std
+    ar_coeff: float = 0.9
+
+    # PIECEWISE_LINEAR: piece lengths in steps are min_piece_length plus a geometric number of extra steps
+    piece_length_mean: float = 20.0
+    min_piece_length: int = 2
+    random_piece_frac: float = 0.0
+
+
+@dataclass
+class SimulatedWalks:
+    packed: PackedTracks
+
+    # Ground truth linear segments as inclusive point idxs into the packed arrays
+    seg_starts: np.ndarray
+    seg_ends: np.ndarray
+
+    # Mask over the points of the ground truth centers of linear triplets, i.e. interior points of the segments
+    is_center_linear_gt: np.ndarray
+
+    def to_tracks(self) -> TracksXy:
+        return self.packed.to_tracks()
+
+
+def _random_velocities(shape, options: RandomWalkOptions, rng: np.random.Generator) -> np.ndarray:
+    angles = rng.uniform(0, 2*np.pi, size=shape)
+    speeds = np.abs(rng.normal(options.speed_mean, options.speed_std, size=shape))
+    return np.stack([ speeds * np.cos(angles), speeds * np.sin(angles) ], axis=-1)
+
+
+def _step_velocities(no_trajs: int, no_steps: int, options: RandomWalkOptions, disps_probs: Optional[List[DispProb]], rng: np.random.Generator):
+    # Velocity of every step (no_trajs, no_steps, 2), and the ground truth piece of every step (-1 if not linear)
+    Model = RandomWalkOptions.MotionModel
+    not_linear = np.full((no_trajs, no_steps), -1, dtype=np.int64)
+
+    if options.motion_model == Model.EMPIRICAL:
+        assert disps_probs is not None and len(disps_probs) > 0, "The empirical motion model needs displacement probabilities"
+        disps = np.array([ [dp.disp_x, dp.disp_y] for dp in disps_probs ], dtype=float)
+        probs = np.array([ dp.prob for dp in disps_probs ], dtype=float)
+        return disps[rng.choice(len(disps_probs), size=(no_trajs, no_steps), p=probs / probs.sum())], not_linear
+
+    if options.motion_model == Model.CONSTANT_VELOCITY:
+        vels = np.repeat(_random_velocities((no_trajs, 1), options, rng), no_steps, axis=1)
+        return vels, np.zeros((no_trajs, no_steps), dtype=np.int64)
+
+    if options.motion_model == Model.CORRELATED:
+        assert 0 <= options.ar_coeff < 1, f"AR coefficient must be in [0,1), got {options.ar_coeff}"
+        means = _random_velocities((no_trajs,), options, rng)
+        eps = rng.normal(0, options.speed_std * np.sqrt(1 - options.ar_coeff**2), size=(no_trajs, no_steps, 2))
+        vels = np.empty((no_trajs, no_steps, 2))
+        if no_steps > 0:
+            vels[:,0] = means + rng.normal(0, options.speed_std, size=(no_trajs, 2))
+        for t in range(1, no_steps):
+            vels[:,t] = means + options.ar_coeff * (vels[:,t-1] - means) + eps[:,t]
+        return vels, not_linear
+
+    # Piece boundaries: cumulative sums of piece lengths, marked on the steps they start at
+    assert options.min_piece_length >= 2, f"Pieces must have at least 2 steps to contain a linear triplet, got {options.min_piece_length}"
+    max_no_pieces = no_steps // options.min_piece_length + 1
+    extra_p = 1 / max(options.piece_length_mean - options.min_piece_length + 1, 1)
+    lengths = options.min_piece_length + rng.geometric(extra_p, size=(no_trajs, max_no_pieces)) - 1
+    starts = np.cumsum(lengths, axis=1)
+    is_piece_start = np.zeros((no_trajs, no_steps + 1), dtype=bool)
+    rows, cols = np.nonzero(starts < no_steps)
+    is_piece_start[rows, starts[rows, cols]] = True
+    piece_idxs = np.cumsum(is_piece_start[:,:no_steps], axis=1)
+
+    piece_vels = _random_velocities((no_trajs, max_no_pieces + 1), options, rng)
+    vels = np.take_along_axis(piece_vels, piece_idxs[:,:,None], axis=1)
+    is_linear_piece = rng.random((no_trajs, max_no_pieces + 1)) >= options.random_piece_frac
+    step_linear = np.take_along_axis(is_linear_piece, piece_idxs, axis=1)
+    vels[~step_linear] += rng.normal(0, options.speed_std, size=(int(np.sum(~step_linear)), 2))
+    return vels, np.where(step_linear, piece_idxs, -1)
+
+
+def sample_walks_packed(
+    no_trajs: int,
+    no_pts_per_traj: int,
+    options: Optional[RandomWalkOptions] = None,
+    disps_probs: Optional[List[DispProb]] = None,
+    seed: Optional[int] = None
+    ) -> SimulatedWalks:
+    # A batch of synthetic trajectories of equal length starting at the origin, generated for all tracks at once
+    options = options if options is not None else RandomWalkOptions()
+    rng = np.random.default_rng(seed)
+    no_steps = max(no_pts_per_traj - 1, 0)
+    vels, step_pieces = _step_velocities(no_trajs, no_steps, options, disps_probs, rng)
+
+    points = np.zeros((no_trajs, no_pts_per_traj, 2))
+    np.cumsum(vels, axis=1, out=points[:,1:])
+    if options.noise_std > 0:
+        points += rng.normal(0, options.noise_std, size=points.shape)
+
+    # A point is a ground truth linear center if the steps before and after it are in the same linear piece
+    is_center_linear_gt = np.zeros((no_trajs, no_pts_per_traj), dtype=bool)
+    is_center_linear_gt[:,1:-1] = (step_pieces[:,:-1] == step_pieces[:,1:]) & (step_pieces[:,1:] >= 0)
+    is_center_linear_gt = is_center_linear_gt.ravel()
+
+    seg_starts, seg_ends = center_mask_to_segment_bounds(is_center_linear_gt)
+
+    packed = PackedTracks(
+        track_ids=np.arange(no_trajs, dtype=np.int64),
+        offsets=np.arange(no_trajs + 1, dtype=np.int64) * no_pts_per_traj,
+        frame_ids=np.tile(np.arange(no_pts_per_traj, dtype=np.int64), no_trajs),
+        data=points.reshape(-1, 2)
+        )
+    return SimulatedWalks(packed=packed, seg_starts=seg_starts, seg_ends=seg_ends, is_center_linear_gt=is_center_linear_gt)
+
+
+def sample_walks(no_trajs: int, no_pts_per_traj: int, options: Optional[RandomWalkOptions] = None, disps_probs: Optional[List[DispProb]] = None, seed: Optional[int] = None) -> TracksXy:
+    return sample_walks_packed(no_trajs, no_pts_per_traj, options, disps_probs, seed).to_tracks()
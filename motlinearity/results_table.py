@@ -0,0 +1,147 @@
+from motlinearity.data import FileToTracks
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_triplets import LinTripletChecker
+from motlinearity.lin_detection_packed import find_linear_centers_packed, center_mask_to_segment_bounds, no_observed_points_in_segments, segment_bounds_to_mask
+
+
+from typing import Dict, List, Tuple
+from dataclasses import dataclass
+from tqdm import tqdm
+import numpy as np
+import csv
+import os
+
+
+@dataclass
+class ResultsTable:
+    columns: Dict[str,np.ndarray]
+
+    @property
+    def no_rows(self) -> int:
+        return len(next(iter(self.columns.values()))) if len(self.columns) > 0 else 0
+
+    @classmethod
+    def concat(cls, tables: List["ResultsTable"]):
+        tables = [ table for table in tables if table.no_rows > 0 ]
+        if len(tables) == 0:
+            return cls({})
+        return cls({ name: np.concatenate([ table.columns[name] for table in tables ]) for name in tables[0].columns })
+
+    def to_csv(self, fname: str):
+        with open(fname, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(self.columns.keys()))
+            writer.writerows(zip(*[ col.tolist() for col in self.columns.values() ]))
+
+    def to_arrow(self):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("pyarrow is required for Arrow and Parquet output: pip install pyarrow")
+        return pa.table({ name: pa.array(col) for name,col in self.columns.items() })
+
+    def to_parquet(self, fname: str):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), fname)
+
+    def to_feather(self, fname: str):
+        import pyarrow.feather as feather
+        feather.write_feather(self.to_arrow(), fname)
+
+    def write(self, fname: str):
+        ext = os.path.splitext(fname)[1]
+        if ext == ".csv":
+            self.to_csv(fname)
+        elif ext == ".parquet":
+            self.to_parquet(fname)
+        elif ext in [".arrow", ".feather"]:
+            self.to_feather(fname)
+        else:
+            raise ValueError(f"Unknown table format {ext} - use .csv, .parquet, .arrow or .feather")
+
+
+def _options_columns(options: LinTripletChecker.Options, no_rows: int) -> Dict[str,np.ndarray]:
+    return {
+        "mode": np.full(no_rows, options.mode.value),
+        "tol": np.full(no_rows, options.tol, dtype=float),
+        "perturb_mag": np.full(no_rows, options.perturb_mag, dtype=float),
+        "xyxy_points": np.full(no_rows, ",".join([ point.value for point in options.xyxy_points ])),
+        "xyxy_combine": np.full(no_rows, options.xyxy_combine.value),
+        }
+
+
+def build_lin_results_tables_packed(seq: str, packed: PackedTracks, options: LinTripletChecker.Options) -> Tuple[ResultsTable,ResultsTable]:
+    # One row per track with the LinStats of the track, and one row per linear segment
+    checker = LinTripletChecker(options)
+    is_center_linear = find_linear_centers_packed(packed, checker)
+    track_idxs = packed.track_idxs()
+    no_tracks = packed.no_tracks
+
+    # Points and durations only count observed points, not those filled in by resampling
+    observed = packed.observed()
+    seg_starts, seg_ends = center_mask_to_segment_bounds(is_center_linear, packed.is_interpolated)
+    in_segments = segment_bounds_to_mask(seg_starts, seg_ends, packed.no_points) & observed
+    seg_track_idxs = track_idxs[seg_starts] if len(seg_starts) > 0 else np.zeros(0, dtype=np.int64)
+    seg_durations_idxs = no_observed_points_in_segments(packed, seg_starts, seg_ends)
+    seg_durations_frames = packed.frame_ids[seg_ends] - packed.frame_ids[seg_starts] + 1
+
+    segs_columns = {
+        "seq": np.full(len(seg_starts), seq),
+        "track_id": packed.track_ids[seg_track_idxs],
+        **_options_columns(options, len(seg_starts)),
+        "idx_start_incl": seg_starts - packed.offsets[seg_track_idxs],
+        "idx_end_incl": seg_ends - packed.offsets[seg_track_idxs],
+        "frame_start": packed.frame_ids[seg_starts],
+        "frame_end": packed.frame_ids[seg_ends],
+        "duration_idxs": seg_durations_idxs,
+        "duration_frames": seg_durations_frames,
+        }
+
+    # Per track aggregates
+    no_points = np.bincount(track_idxs[observed], minlength=no_tracks)
+    no_lin_segments = np.bincount(seg_track_idxs, minlength=no_tracks)
+    no_points_in_lin_segments = np.bincount(track_idxs[in_segments], minlength=no_tracks)
+    frac = np.zeros(no_tracks)
+    np.divide(no_points_in_lin_segments, no_points, out=frac, where=no_points > 0)
+
+    def _mean_std(durations: np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+        sums = np.bincount(seg_track_idxs, weights=durations, minlength=no_tracks)
+        sums_sq = np.bincount(seg_track_idxs, weights=durations.astype(float)**2, minlength=no_tracks)
+        mean = np.zeros(no_tracks)
+        mean_sq = np.zeros(no_tracks)
+        np.divide(sums, no_lin_segments, out=mean, where=no_lin_segments > 0)
+        np.divide(sums_sq, no_lin_segments, out=mean_sq, where=no_lin_segments > 0)
+        return mean, np.sqrt(np.maximum(mean_sq - mean**2, 0))
+
+    mean_idxs, std_idxs = _mean_std(seg_durations_idxs)
+    mean_frames, std_frames = _mean_std(seg_durations_frames)
+    max_idxs = np.zeros(no_tracks, dtype=np.int64)
+    np.maximum.at(max_idxs, seg_track_idxs, seg_durations_idxs)
+
+    stats_columns = {
+        "seq": np.full(no_tracks, seq),
+        "track_id": packed.track_ids,
+        **_options_columns(options, no_tracks),
+        "no_lin_segments": no_lin_segments,
+        "no_points_in_lin_segments": no_points_in_lin_segments,
+        "no_points_in_track": no_points,
+        "frac_of_points_in_linear_segments": frac,
+        "lin_segments_mean_duration_idxs": mean_idxs,
+        "lin_segments_std_duration_idxs": std_idxs,
+        "lin_segments_max_duration_idxs": max_idxs,
+        "lin_segments_mean_duration_frames": mean_frames,
+        "lin_segments_std_duration_frames": std_frames,
+        }
+    return ResultsTable(stats_columns), ResultsTable(segs_columns)
+
+
+def build_lin_results_tables_all_files(file_to_tracks: FileToTracks, options_list: List[LinTripletChecker.Options]) -> Tuple[ResultsTable,ResultsTable]:
+    stats_tables = []
+    segs_tables = []
+    for fname,tracks in tqdm(file_to_tracks.items(), desc="Building linear stats tables for each file"):
+        packed = PackedTracks.from_tracks(tracks)
+        for options in options_list:
+            stats_table, segs_table = build_lin_results_tables_packed(fname, packed, options)
+            stats_tables.append(stats_table)
+            segs_tables.append(segs_table)
+    return ResultsTable.concat(stats_tables), ResultsTable.concat(segs_tables)
@@ -0,0 +1,191 @@
+from motlinearity.data import FileToTracks
+from motlinearity.data_arrays import PackedTracks
+
+
+from typing import Dict, Tuple, Optional, Callable, Any, Iterator
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from enum import Enum
+from loguru import logger
+import numpy as np
+import tempfile
+import sys
+import os
+
+
+_ALIGN_BYTES = 64
+_ARRAY_NAMES = ["track_ids", "offsets", "frame_ids", "data", "confs", "parent_track_ids", "is_interpolated"]
+
+
+@dataclass
+class SharedArraySpec:
+    offset_bytes: int
+    shape: Tuple[int,...]
+    dtype: str
+
+
+@dataclass
+class SharedSeqSpec:
+    arrays: Dict[str,SharedArraySpec]
+    is_gt: bool
+
+
+@dataclass
+class SharedTracksHandle:
+    # Picklable description of published tracks, passed to workers
+    backend: "SharedTracks.Backend"
+    block: str
+    size_bytes: int
+    seqs: Dict[str,SharedSeqSpec]
+
+
+class SharedTracks:
+
+
+    class Backend(Enum):
+        SHARED_MEMORY = "shared-memory"
+        MEMMAP = "memmap"
+
+
+    def __init__(self, file_to_tracks: FileToTracks, backend: Backend = Backend.SHARED_MEMORY, memmap_dir: Optional[str] = None):
+        # Lay out the arrays of all sequences in a single block
+        file_to_packed = { fname: PackedTracks.from_tracks(tracks) for fname,tracks in file_to_tracks.items() }
+        seqs: Dict[str,SharedSeqSpec] = {}
+        size_bytes = 0
+        for fname,packed in file_to_packed.items():
+            arrays = {}
+            for name in _ARRAY_NAMES:
+                arr = getattr(packed, name)
+                if arr is None:
+                    continue
+                size_bytes = -(-size_bytes // _ALIGN_BYTES) * _ALIGN_BYTES
+                arrays[name] = SharedArraySpec(offset_bytes=size_bytes, shape=arr.shape, dtype=arr.dtype.str)
+                size_bytes += arr.nbytes
+            seqs[fname] = SharedSeqSpec(arrays=arrays, is_gt=packed.is_gt)
+        size_bytes = max(size_bytes, 1)
+
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._memmap_fname: Optional[str] = None
+        if backend == self.Backend.SHARED_MEMORY:
+            self._shm = shared_memory.SharedMemory(create=True, size=size_bytes)
+            block = self._shm.name
+            buf = self._shm.buf
+        elif backend == self.Backend.MEMMAP:
+            fd, block = tempfile.mkstemp(suffix=".bin", prefix="motlinearity_", dir=memmap_dir)
+            os.close(fd)
+            self._memmap_fname = block
+            buf = np.memmap(block, dtype=np.uint8, mode="w+", shape=(size_bytes,))
+        else:
+            raise NotImplementedError(f"Unknown backend {backend}")
+
+        for fname,packed in file_to_packed.items():
+            for name,spec in seqs[fname].arrays.items():
+                np.ndarray(spec.shape, dtype=spec.dtype, buffer=buf, offset=spec.offset_bytes)[...] = getattr(packed, name)
+
+        if backend == self.Backend.MEMMAP:
+            buf.flush()
+        del buf
+
+        self.handle = SharedTracksHandle(backend=backend, block=block, size_bytes=size_bytes, seqs=seqs)
+        logger.debug(f"Published {len(seqs)} sequences ({size_bytes} bytes) to {backend.value} block {block}")
+
+
+    def close(self):
+        # Release the block; workers must have detached first
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._memmap_fname is not None:
+            os.remove(self._memmap_fname)
+            self._memmap_fname = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AttachedTracks:
+
+
+    def __init__(self, handle: SharedTracksHandle):
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        if handle.backend == SharedTracks.Backend.SHARED_MEMORY:
+            if sys.version_info >= (3,13):
+                self._shm = shared_memory.SharedMemory(name=handle.block, track=False)
+            else:
+                self._shm = shared_memory.SharedMemory(name=handle.block)
+            buf = self._shm.buf
+        elif handle.backend == SharedTracks.Backend.MEMMAP:
+            buf = np.memmap(handle.block, dtype=np.uint8, mode="r", shape=(handle.size_bytes,))
+        else:
+            raise NotImplementedError(f"Unknown backend {handle.backend}")
+
+        # Zero-copy, read-only views
+        self.file_to_packed: Dict[str,PackedTracks] = {}
+        for fname,seq in handle.seqs.items():
+            arrays = {}
+            for name,spec in seq.arrays.items():
+                arrays[name] = np.ndarray(spec.shape, dtype=spec.dtype, buffer=buf, offset=spec.offset_bytes)
+                arrays[name].flags.writeable = False
+            self.file_to_packed[fname] = PackedTracks(is_gt=seq.is_gt, **arrays)
+
+
+    def close(self):
+        # Views into the block are invalid after this
+        self.file_to_packed = {}
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                logger.warning(f"Views into shared block {self._shm.name} are still referenced, leaving it mapped")
+            self._shm = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Attachment of the current worker process
+_worker_tracks: Optional[AttachedTracks] = None
+
+
+def init_shared_tracks_worker(handle: SharedTracksHandle):
+    # Pool workers end with os._exit, which skips atexit, but run multiprocessing finalizers when they shut down
+    global _worker_tracks
+    _worker_tracks = AttachedTracks(handle)
+    Finalize(None, _worker_tracks.close, exitpriority=10)
+
+
+def get_shared_tracks(fname: str) -> PackedTracks:
+    assert _worker_tracks is not None, "Worker not initialized - use init_shared_tracks_worker"
+    return _worker_tracks.file_to_packed[fname]
+
+
+def _call_with_shared_tracks(fn: Callable[[str,PackedTracks],Any], fname: str) -> Any:
+    return fn(fname, get_shared_tracks(fname))
+
+
+def map_shared_tracks(fn: Callable[[str,PackedTracks],Any], handle: SharedTracksHandle, no_workers: int) -> Dict[str,Any]:
+    # fn must be picklable, i.e. a module level function
+    with ProcessPoolExecutor(max_workers=no_workers, initializer=init_shared_tracks_worker, initargs=(handle,)) as executor:
+        futures = { fname: executor.submit(_call_with_shared_tracks, fn, fname) for fname in handle.seqs }
+        return { fname: f.result() for fname,f in futures.items() }
+
+
+def imap_shared_tracks(fn: Callable[[str,PackedTracks],Any], handle: SharedTracksHandle, no_workers: int) -> Iterator[Tuple[str,Any]]:
+    # Yields (fname, result) as each sequence completes, so callers can save results before the others finish
+    with ProcessPoolExecutor(max_workers=no_workers, initializer=init_shared_tracks_worker, initargs=(handle,)) as executor:
+        futures = { executor.submit(_call_with_shared_tracks, fn, fname): fname for fname in handle.seqs }
+        for f in as_completed(futures):
+            yield futures[f], f.result()
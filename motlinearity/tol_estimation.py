@@ -0,0 +1,191 @@
+from motlinearity.data import Tracks, FileToTracks, BoxDisps
+from motlinearity.data_arrays import PackedTracks
+from motlinearity.lin_detection_triplets import LinTripletChecker
+
+
+from typing import Optional, Dict, Tuple
+from dataclasses import dataclass
+from mashumaro import DataClassDictMixin
+from tqdm import tqdm
+import numpy as np
+
+
+# Scale from the median absolute deviation to the std of a normal distribution
+_MAD_TO_STD = 1.4826
+
+
+def _quantization_floor(packed: PackedTracks, quantization_step: Optional[float]) -> float:
+    # Rounding to a grid of step q adds uniform noise of std q / sqrt(12), a lower bound on the localization noise
+    # The MAD of second differences is 0 on rounded or interpolated integer tracks, so it can not see this noise
+    # With quantization_step None, a step of 1 pixel is assumed for integer data and no floor otherwise
+    if quantization_step is None:
+        quantization_step = 1.0 if packed.no_points > 0 and np.all(packed.data == np.round(packed.data)) else 0.0
+    return quantization_step / np.sqrt(12)
+
+
+@dataclass
+class TolEstimate(DataClassDictMixin):
+    # Localization noise std of a box coordinate (pixels)
+    noise_std: float
+    tol: float
+    coverage: float
+    no_triplets: int
+
+    # Mode tol is a bound for: slope differences (TOL, TOL_CROSS) and sines of angles (ANGLE) are not interchangeable
+    # PERTURB is not calibrated: its slope ranges assume steps with positive x and y, so on motion in all directions
+    # it never reaches a useful coverage for any perturb_mag
+    tol_mode: LinTripletChecker.Options.Mode = LinTripletChecker.Options.Mode.TOL
+
+    def options(self, mode: Optional[LinTripletChecker.Options.Mode] = None, base: Optional[LinTripletChecker.Options] = None) -> LinTripletChecker.Options:
+        Mode = LinTripletChecker.Options.Mode
+        mode = mode if mode is not None else self.tol_mode
+        assert mode == self.tol_mode or { mode, self.tol_mode } == { Mode.TOL, Mode.TOL_CROSS }, f"The tol was estimated for {self.tol_mode}, not {mode}"
+        options = LinTripletChecker.Options.from_dict(base.to_dict()) if base is not None else LinTripletChecker.Options()
+        options.mode = mode
+        options.tol = self.tol
+        return options
+
+
+def _group_quantiles(values: np.ndarray, groups: np.ndarray, no_groups: int, q: float) -> np.ndarray:
+    # Quantile of the values in each group (lower interpolation), nan for empty groups
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=no_groups)
+    starts = np.cumsum(counts) - counts
+    quantiles = np.full(no_groups, np.nan)
+    has_values = counts > 0
+    quantiles[has_values] = values[order][starts[has_values] + np.floor(q * (counts[has_values] - 1)).astype(np.int64)]
+    return quantiles
+
+
+def _consecutive_triplets(packed: PackedTracks, max_gap: int) -> np.ndarray:
+    # Start idxs of triplets of points in the same track and at most max_gap frames apart
+    if packed.no_points < 3:
+        return np.zeros(0, dtype=np.int64)
+    step_valid = packed.same_track_as_next() & (np.diff(packed.frame_ids) <= max_gap)
+    return np.nonzero(step_valid[:-1] & step_valid[1:])[0]
+
+
+def estimate_noise_std_per_track_packed(packed: PackedTracks, max_gap: int = 1, quantization_step: Optional[float] = None) -> np.ndarray:
+    # For constant velocity motion with independent noise of std sigma on each coordinate, the second difference
+    # x[i+1] - 2 x[i] + x[i-1] has std sqrt(6) sigma; the median absolute deviation keeps turns from inflating the estimate
+    starts = _consecutive_triplets(packed, max_gap)
+    second_diffs = np.abs(packed.data[starts+2] - 2 * packed.data[starts+1] + packed.data[starts])
+    groups = np.repeat(packed.track_idxs()[starts], packed.data.shape[1])
+    noise_stds = _MAD_TO_STD * _group_quantiles(second_diffs.ravel(), groups, packed.no_tracks, 0.5) / np.sqrt(6)
+    return np.fmax(noise_stds, _quantization_floor(packed, quantization_step)) if len(starts) > 0 else noise_stds
+
+
+def estimate_noise_std_packed(packed: PackedTracks, max_gap: int = 1, disps: Optional[BoxDisps] = None, quantization_step: Optional[float] = None) -> float:
+    starts = _consecutive_triplets(packed, max_gap)
+    if len(starts) == 0:
+        return np.nan
+    second_diffs = np.abs(packed.data[starts+2] - 2 * packed.data[starts+1] + packed.data[starts])
+    noise_std = _MAD_TO_STD * float(np.median(second_diffs)) / np.sqrt(6)
+
+    # Displacements between frames have variance var(velocity) + 2 sigma^2, which bounds the noise from above
+    if disps is not None:
+        noise_std = min(noise_std, min(disps.xy_disp_std) / np.sqrt(2))
+    return max(noise_std, _quantization_floor(packed, quantization_step))
+
+
+def _noisy_straight_triplets(packed: PackedTracks, starts: np.ndarray, noise_stds: np.ndarray, min_step_noise_ratio: float, rng: np.random.Generator) -> Tuple[np.ndarray,np.ndarray,np.ndarray,np.ndarray]:
+    # Straight, evenly spaced triplets with the observed centers and steps of the data, observed with the estimated noise
+    # Only triplets that move by more than min_step_noise_ratio times the noise are kept, since the slopes of
+    # nearly stationary points are dominated by noise and are not linear in either mode
+    data = packed.data
+    centers = data[starts+1]
+    steps = 0.5 * (data[starts+2] - data[starts])
+    step_lengths = np.min([ np.hypot(steps[:,i], steps[:,i+1]) for i in range(0, data.shape[1], 2) ], axis=0)
+    moving = step_lengths > min_step_noise_ratio * noise_stds
+    centers, steps, noise_stds = centers[moving], steps[moving], noise_stds[moving]
+
+    noise = rng.standard_normal((3,) + centers.shape) * noise_stds[None,:,None]
+    return centers - steps + noise[0], centers + noise[1], centers + steps + noise[2], moving
+
+
+def _tol_mode(options: LinTripletChecker.Options) -> LinTripletChecker.Options.Mode:
+    # Mode the tol is estimated for: the mode of the options, or TOL for PERTURB, which has no tol
+    return LinTripletChecker.Options.Mode.TOL if options.mode == LinTripletChecker.Options.Mode.PERTURB else options.mode
+
+
+def _tol_scores(options: LinTripletChecker.Options, xy1s: np.ndarray, xy2s: np.ndarray, xy3s: np.ndarray) -> np.ndarray:
+    checker = LinTripletChecker(LinTripletChecker.Options.from_dict(options.to_dict()))
+    checker.options.mode = _tol_mode(options)
+    if xy1s.shape[1] == 4:
+        return checker.xyxy_triplet_scores(xy1s, xy2s, xy3s)
+    return checker.triplet_scores(xy1s, xy2s, xy3s)
+
+
+def estimate_tol_packed(
+    packed: PackedTracks,
+    options: Optional[LinTripletChecker.Options] = None,
+    coverage: float = 0.9,
+    max_gap: int = 1,
+    min_step_noise_ratio: float = 3.0,
+    noise_std: Optional[float] = None,
+    disps: Optional[BoxDisps] = None,
+    quantization_step: Optional[float] = None,
+    seed: Optional[int] = 0
+    ) -> TolEstimate:
+    # Calibrate tol such that a fraction coverage of truly linear triplets, observed with the estimated noise,
+    # are detected as linear by the checker with the given options
+    assert 0 < coverage < 1, f"Coverage must be in (0,1), got {coverage}"
+    options = options if options is not None else LinTripletChecker.Options()
+    if noise_std is None:
+        noise_std = estimate_noise_std_packed(packed, max_gap, disps, quantization_step)
+
+    starts = _consecutive_triplets(packed, max_gap)
+    rng = np.random.default_rng(seed)
+    xy1s, xy2s, xy3s, _ = _noisy_straight_triplets(packed, starts, np.full(len(starts), noise_std), min_step_noise_ratio, rng)
+
+    # Without noise (or without moving triplets) there is nothing to calibrate to
+    if len(xy1s) == 0 or not noise_std > 0:
+        tol = np.nan
+    else:
+        tol = float(np.quantile(_tol_scores(options, xy1s, xy2s, xy3s), coverage))
+
+    return TolEstimate(
+        noise_std=float(noise_std),
+        tol=tol,
+        coverage=coverage,
+        no_triplets=len(xy1s),
+        tol_mode=_tol_mode(options)
+        )
+
+
+def estimate_tol(tracks: Tracks, **kwargs) -> TolEstimate:
+    return estimate_tol_packed(PackedTracks.from_tracks(tracks), **kwargs)
+
+
+def estimate_tol_all_files(file_to_tracks: FileToTracks, **kwargs) -> Dict[str,TolEstimate]:
+    file_to_estimate = {}
+    for fname,tracks in tqdm(file_to_tracks.items(), desc="Estimating tolerance for each file"):
+        file_to_estimate[fname] = estimate_tol(tracks, **kwargs)
+    return file_to_estimate
+
+
+def estimate_tol_per_track_packed(
+    packed: PackedTracks,
+    options: Optional[LinTripletChecker.Options] = None,
+    coverage: float = 0.9,
+    max_gap: int = 1,
+    min_step_noise_ratio: float = 3.0,
+    quantization_step: Optional[float] = None,
+    seed: Optional[int] = 0
+    ) -> Tuple[np.ndarray,np.ndarray]:
+    # Per-track noise std and tol, nan for tracks that are too short, never move or have no noise
+    assert 0 < coverage < 1, f"Coverage must be in (0,1), got {coverage}"
+    options = options if options is not None else LinTripletChecker.Options()
+    noise_stds = estimate_noise_std_per_track_packed(packed, max_gap, quantization_step)
+
+    # Tracks without noise are left out, since their triplets can not be scaled to unit noise
+    starts = _consecutive_triplets(packed, max_gap)
+    starts = starts[noise_stds[packed.track_idxs()[starts]] > 0]
+    triplet_track_idxs = packed.track_idxs()[starts]
+    rng = np.random.default_rng(seed)
+    xy1s, xy2s, xy3s, moving = _noisy_straight_triplets(packed, starts, noise_stds[triplet_track_idxs], min_step_noise_ratio, rng)
+    if len(xy1s) == 0:
+        return noise_stds, np.full(packed.no_tracks, np.nan)
+
+    tols = _group_quantiles(_tol_scores(options, xy1s, xy2s, xy3s), triplet_track_idxs[moving], packed.no_tracks, coverage)
+    return noise_stds, tols